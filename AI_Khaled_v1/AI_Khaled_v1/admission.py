@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+admission.py — التحكم في الدخول (admission control) وفصل الشغل غير العاجل
+- Gate: حد أقصى للطلبات الشغالة في نفس الوقت + طابور انتظار قصير.
+  الطابور مليان -> 429 فوراً، والانتظار طوّل أكتر من queue_timeout_ms -> 503، والاتنين فيهم Retry-After.
+- بوابتين: "chat" للشات التفاعلي و "admin" لـ stats / backup / export / retrain،
+  فطلبات الإدارة التقيلة مش بتاكل من سعة الشات.
+- BackgroundWorker: thread واحد بطابور محدود للشغل اللي مش لازم يخلص قبل الرد
+  (كتابة auto-learn وتشغيل التدريب). المهام اللي ليها key بتتدمج لو فيه واحدة مستنية.
+  عند الخروج (atexit) بيبطل يستقبل وبيخلص المهام الباقية في حدود drain_timeout ثانية.
+- AsyncGate: نفس البوابة (نفس الحدود والعدادات) لكن الانتظار على event loop (وضع ASGI، asgi_app.py).
+- stats(): عمق الطوابير وعدادات الرفض عشان نقدر نحدد عدد الـ workers.
+
+الإعدادات من config.json تحت "admission":
+  {"chat": {"max_inflight": 8, "max_queue": 16, "queue_timeout_ms": 1000},
+   "admin": {"max_inflight": 2, "max_queue": 4, "queue_timeout_ms": 2000},
+   "retry_after": 1, "background_queue": 1000, "drain_timeout": 5}
+"""
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+DEFAULTS = {
+    "chat": {"max_inflight": 8, "max_queue": 16, "queue_timeout_ms": 1000},
+    "admin": {"max_inflight": 2, "max_queue": 4, "queue_timeout_ms": 2000},
+    "retry_after": 1,         # ثواني في هيدر Retry-After
+    "background_queue": 1000, # أقصى عدد مهام مستنية في BackgroundWorker
+    "drain_timeout": 5,       # ثواني لتخليص المهام الباقية عند الخروج
+}
+
+_settings = {"retry_after": DEFAULTS["retry_after"], "drain_timeout": DEFAULTS["drain_timeout"]}
+_lock = threading.Lock()
+
+class Rejected(Exception):
+    """الطلب اترفض قبل ما يبدأ: status 429 (الطابور مليان) أو 503 (الانتظار طوّل)."""
+
+    def __init__(self, gate: str, status: int, reason: str, retry_after: int):
+        super().__init__(f"{gate}: {reason}")
+        self.gate = gate
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+# ------------------------
+# Gate
+# ------------------------
+class Gate:
+    def __init__(self, name, max_inflight, max_queue, queue_timeout_ms):
+        self.name = name
+        self._cond = threading.Condition()
+        self.resize(max_inflight, max_queue, queue_timeout_ms)
+        self.inflight = 0
+        self.waiting = 0
+        self.peak_inflight = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_ms_total = 0.0
+
+    def resize(self, max_inflight, max_queue, queue_timeout_ms):
+        with self._cond:
+            self.max_inflight = max(1, int(max_inflight))
+            self.max_queue = max(0, int(max_queue))
+            self.queue_timeout = max(0.0, float(queue_timeout_ms)) / 1000.0
+            self._cond.notify_all()
+
+    def enter(self):
+        with self._cond:
+            # الطابور مش فاضي -> ادخل الطابور حتى لو فيه مكان (عشان الترتيب يفضل عادل)
+            if self.inflight < self.max_inflight and self.waiting == 0:
+                self._admit(0.0)
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected_full += 1
+                raise Rejected(self.name, 429, "too many requests", _retry_after())
+            self.waiting += 1
+            self.queued += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            start = time.perf_counter()
+            deadline = start + self.queue_timeout
+            try:
+                while self.inflight >= self.max_inflight:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        raise Rejected(self.name, 503, "server busy", _retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self._admit(time.perf_counter() - start)
+
+    def _admit(self, waited):
+        self.inflight += 1
+        self.admitted += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        self.wait_ms_total += waited * 1000
+
+    def leave(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.enter()
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_inflight": self.max_inflight,
+                "max_queue": self.max_queue,
+                "queue_timeout_ms": round(self.queue_timeout * 1000),
+                "inflight": self.inflight,
+                "waiting": self.waiting,
+                "peak_inflight": self.peak_inflight,
+                "peak_waiting": self.peak_waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_wait_ms": round(self.wait_ms_total / self.admitted, 2) if self.admitted else 0.0,
+            }
+
+class AsyncGate:
+    """
+    نسخة asyncio من Gate: بتستخدم حدود وعدادات الـ Gate نفسها، لكن اللي مستني
+    بيستنى future على الـ event loop بدل ما يحجز thread.
+    لما طلب يخلص والطابور فيه حد، المكان بيتسلم له مباشرة (inflight مابيقلش).
+    الـ Gate الواحدة لازم تتدخل من مسار واحد بس (threads أو asyncio) عشان الإيقاظ يوصل للكل.
+    """
+
+    def __init__(self, gate: Gate):
+        self.gate = gate
+        self._waiters = deque()
+
+    async def enter(self):
+        g = self.gate
+        with g._cond:
+            self._wake_spare()
+            if g.inflight < g.max_inflight and not self._waiters:
+                g._admit(0.0)
+                return
+            if g.waiting >= g.max_queue:
+                g.rejected_full += 1
+                raise Rejected(g.name, 429, "too many requests", _retry_after())
+            g.waiting += 1
+            g.queued += 1
+            g.peak_waiting = max(g.peak_waiting, g.waiting)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), g.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            handed = fut.done() and not fut.cancelled()
+            if not handed:
+                fut.cancel()
+                with g._cond:
+                    g.waiting -= 1
+                    if timed_out:
+                        g.rejected_timeout += 1
+                if timed_out:
+                    raise Rejected(g.name, 503, "server busy", _retry_after()) from None
+                raise
+            if not timed_out:
+                # العميل قفل بعد ما المكان اتسلم له: رجّعه
+                with g._cond:
+                    g.waiting -= 1
+                self.leave()
+                raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+        # leave() سلّمنا المكان: inflight محسوب بالفعل
+        with g._cond:
+            g.waiting -= 1
+            g.admitted += 1
+            g.wait_ms_total += (time.perf_counter() - start) * 1000
+
+    def _wake_spare(self):
+        # لو الحد زاد (configure) وفيه مستنيين، سلّمهم الأماكن الفاضية (تحت g._cond)
+        g = self.gate
+        while self._waiters and g.inflight < g.max_inflight:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                g.inflight += 1
+                g.peak_inflight = max(g.peak_inflight, g.inflight)
+                fut.set_result(None)
+
+    def leave(self):
+        g = self.gate
+        with g._cond:
+            while self._waiters:
+                fut = self._waiters.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    return
+            g.inflight -= 1
+            g._cond.notify()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.enter()
+        try:
+            yield
+        finally:
+            self.leave()
+
+_gates = {name: Gate(name, **DEFAULTS[name]) for name in ("chat", "admin")}
+_async_gates = {}
+
+def _retry_after() -> int:
+    return max(1, int(_settings.get("retry_after", 1)))
+
+@contextmanager
+def slot(gate: str):
+    with _gates[gate].slot():
+        yield
+
+def async_gate(gate: str) -> AsyncGate:
+    """AsyncGate لبوابة بالاسم (واحدة لكل بوابة، لازم تتنادى من جوه الـ event loop)."""
+    ag = _async_gates.get(gate)
+    if ag is None:
+        ag = _async_gates[gate] = AsyncGate(_gates[gate])
+    return ag
+
+def gated(gate: str):
+    """decorator لـ route: الطلب مش بيبدأ غير لما ياخد مكان في البوابة (وإلا Rejected)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _gates[gate].slot():
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+# ------------------------
+# Background work (غير عاجل)
+# ------------------------
+class BackgroundWorker:
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._keys = set()  # مهام مستنية بالـ key بتاعها (للدمج)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.submitted = 0
+        self.done = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def submit(self, name, fn, *args, key=None) -> bool:
+        with self._lock:
+            if self._closed:
+                logging.info(f"[ADMISSION] shutting down, not running '{name}'")
+                return False
+            if key is not None and key in self._keys:
+                self.coalesced += 1
+                return True
+            try:
+                self._queue.put_nowait((name, fn, args, key))
+            except queue.Full:
+                self.dropped += 1
+                logging.warning(f"[ADMISSION] background queue full, dropped '{name}'")
+                return False
+            if key is not None:
+                self._keys.add(key)
+            self.submitted += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="background-worker", daemon=True)
+                self._thread.start()
+        return True
+
+    def _run(self):
+        while True:
+            self._execute(self._queue.get())
+
+    def _execute(self, item):
+        name, fn, args, key = item
+        if key is not None:
+            # اتشالت قبل التنفيذ: أي طلب جديد بعد كده بيتنفذ تاني (ممكن يشوف بيانات أحدث)
+            with self._lock:
+                self._keys.discard(key)
+        try:
+            fn(*args)
+            self.done += 1
+        except Exception as e:
+            self.failed += 1
+            logging.warning(f"[ADMISSION] background task '{name}' failed: {e}")
+        finally:
+            self._queue.task_done()
+
+    def drain(self, timeout: float) -> int:
+        """
+        عند الخروج: بطّل استقبال مهام، شغل الباقي في الـ thread الحالي (الـ worker daemon وهيموت مع العملية)،
+        واستنى المهمة اللي شغالة في الـ worker لو فيه. يرجع عدد المهام اللي ماخلصتش في الوقت.
+        """
+        with self._lock:
+            self._closed = True
+        deadline = time.monotonic() + max(0.0, timeout)
+        while time.monotonic() < deadline:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._execute(item)
+        q = self._queue
+        with q.all_tasks_done:
+            while q.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                q.all_tasks_done.wait(remaining)
+            left = q.unfinished_tasks
+        if left:
+            logging.warning(f"[ADMISSION] exit: {left} background tasks not finished in {timeout}s")
+        return left
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "submitted": self.submitted,
+            "done": self.done,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+_background = BackgroundWorker(DEFAULTS["background_queue"])
+
+def defer(name: str, fn, *args, key=None) -> bool:
+    """شغل fn(*args) في الخلفية بعد الرد. key بيدمج المهام المتشابهة اللي لسه مستنية."""
+    return _background.submit(name, fn, *args, key=key)
+
+@atexit.register
+def _drain_background():
+    _background.drain(float(_settings.get("drain_timeout", DEFAULTS["drain_timeout"])))
+
+# ------------------------
+# إعدادات وعدادات
+# ------------------------
+def configure(cfg: dict):
+    """يُستدعى مع كل نسخة جديدة من config.json (watcher)."""
+    section = (cfg or {}).get("admission") or {}
+    if not isinstance(section, dict):
+        return
+    with _lock:
+        _settings["retry_after"] = section.get("retry_after", DEFAULTS["retry_after"])
+        _settings["drain_timeout"] = section.get("drain_timeout", DEFAULTS["drain_timeout"])
+        for name, gate in _gates.items():
+            conf = dict(DEFAULTS[name])
+            conf.update(section.get(name) or {})
+            gate.resize(conf["max_inflight"], conf["max_queue"], conf["queue_timeout_ms"])
+        size = int(section.get("background_queue", DEFAULTS["background_queue"]))
+        _background._queue.maxsize = max(1, size)
+
+def stats() -> dict:
+    return {
+        "gates": {name: gate.stats() for name, gate in _gates.items()},
+        "background": _background.stats(),
+        "retry_after": _retry_after(),
+    }
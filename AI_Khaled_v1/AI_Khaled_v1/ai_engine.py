@@ -8,23 +8,38 @@ ai_engine.py — محرك الردود الذكي (معدّل)
 - عندما لا يوجد رد مناسب، يُسجَّل السؤال كـ pending وتُعاد رسالة التعلم فقط.
 """
 import os
+import sys
 import json
 import csv
 import random
-import logging
 import re
 import threading
-import pickle
+import subprocess
+import time
+import atexit
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
 from datetime import datetime
 
+import profiling
+import admission
+import log_pipeline
+from log_pipeline import log_event
+from watcher import get_watcher
+from corpus_store import get_store
+from history import get_history
+from model_store import ModelStore
+
 ROOT = Path(__file__).parent
-DATA_DIR = ROOT / "data"
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
 MEM_PATH = DATA_DIR / "memory.json"
 DS_PATH = DATA_DIR / "dataset.csv"
 KB_PATH = DATA_DIR / "kb.json"
-MODEL_PATH = ROOT / "model" / "khalid_model.pkl"
+MODEL_DIR = Path(os.environ.get("AI_KHALED_MODEL_DIR") or ROOT / "model")
+MODEL_PATH = MODEL_DIR / "khalid_model.pkl"
 CONFIG_PATH = DATA_DIR / "config.json"
+REPLY_CACHE_PATH = DATA_DIR / "reply_cache.json"
 
 # إعدادات
 SIMILARITY_THRESHOLD_RETRIEVE = 0.45
@@ -33,16 +48,22 @@ MARKOV_N = 2
 MARKOV_MAX_LEN = 40
 AUTO_RETRAIN_DEFAULT = False
 
-# logging
+# ميزانية الوقت لكل طلب (ms) — تتغير من config: reply_budget_ms / tier_budgets_ms / tier_workers
+REPLY_BUDGET_MS = 1500
+TIER_BUDGETS_MS = {"memory": 500, "dataset": 500, "ml": 1000}
+TIER_WORKERS = 4
+
+# حفظ كاش الردود على القرص (ثواني) — reply_cache_save_interval في config
+REPLY_CACHE_SAVE_INTERVAL = 300
+
 LOG_PATH = DATA_DIR / "ai_engine.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] [ai_engine] [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler(LOG_PATH, encoding="utf-8"), logging.StreamHandler()]
-)
 
 # تأكد وجود المجلدات والملفات الافتراضية
 DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# logging: طابور + writer thread (log_pipeline.py)، الكتابة للقرص مش في مسار الطلب
+log = log_pipeline.setup_logging(LOG_PATH, name="ai_engine",
+                                 fmt="[%(asctime)s] [ai_engine] [%(levelname)s] %(message)s")
 if not MEM_PATH.exists():
     MEM_PATH.write_text(json.dumps({"sessions": []}, ensure_ascii=False, indent=2), encoding="utf-8")
 if not DS_PATH.exists():
@@ -55,16 +76,19 @@ if not CONFIG_PATH.exists():
     CONFIG_PATH.write_text(json.dumps({"auto_retrain": AUTO_RETRAIN_DEFAULT, "auto_train": True}, ensure_ascii=False, indent=2), encoding="utf-8")
 
 # locks للحماية
-_ds_lock = threading.Lock()
 _mem_lock = threading.Lock()
 _kb_lock = threading.Lock()
 
 # كاش بسيط
-_reply_cache = {}  # normalized_text -> reply
+_reply_cache = {}  # normalized_text -> (data_version, reply)
 
 # pending map لجلسات التعلم الذاتي
 _pending = {}  # session_id -> question
 
+# تظهر أحجامهم في لقطات tracemalloc (profiling.py)
+profiling.track("_reply_cache", lambda: _reply_cache)
+profiling.track("_pending", lambda: _pending)
+
 # ------------------------
 # أدوات مساعدة
 # ------------------------
@@ -91,7 +115,7 @@ def _read_json(path: Path, default):
     try:
         return json.load(open(path, "r", encoding="utf-8"))
     except Exception as e:
-        logging.warning(f"failed reading {path}: {e}")
+        log.warning(f"failed reading {path}: {e}")
         return default
 
 def _write_json(path: Path, data):
@@ -99,42 +123,57 @@ def _write_json(path: Path, data):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 # ------------------------
-# تحميل KB و dataset (كاش)
+# تحميل config و KB والنموذج (لقطات من watcher) و dataset (corpus_store المشترك مع app)
+# الكاش يتحدث تلقائياً لما الملفات تتغير من برة العملية
 # ------------------------
-_kb_cache = None
-_dataset_cache = None
+_watcher = get_watcher()
+_store = get_store()
+_config_cache = {}
+_kb_cache = {}
 
-def _load_kb():
+def _on_config(snap):
+    global _config_cache
+    _config_cache = snap.data if isinstance(snap.data, dict) else {}
+    log_pipeline.configure(_config_cache)
+
+def _on_kb(snap):
     global _kb_cache
-    if _kb_cache is None:
-        _kb_cache = _read_json(KB_PATH, {})
+    _kb_cache = snap.data if isinstance(snap.data, dict) else {}
+
+_watcher.subscribe("config", _on_config)
+_watcher.subscribe("kb", _on_kb)
+
+# نموذج الـ ML المقيم: بيتحمل من الملف، وبعدين أي زوج بيتضاف لـ dataset بيتضاف له في الخلفية
+_ml = ModelStore(_store, lambda: trigger_retrain(), lambda: _config_cache.get("ml_incremental"))
+_watcher.subscribe("model", lambda snap: _ml.reset(snap.data))
+
+def _config():
+    return _config_cache
+
+def _load_kb():
     return _kb_cache
 
 def _load_dataset():
-    global _dataset_cache
-    if _dataset_cache is not None:
-        return _dataset_cache
-    pairs = []
-    try:
-        with open(DS_PATH, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader, None)
-            for row in reader:
-                if len(row) >= 2:
-                    q = row[0].strip()
-                    a = row[1].strip()
-                    if q and a:
-                        pairs.append((q, a))
-    except Exception as e:
-        logging.warning(f"failed loading dataset.csv: {e}")
-    _dataset_cache = pairs
-    logging.info(f"dataset loaded: {len(pairs)} pairs")
-    return _dataset_cache
+    return _store
 
 def _refresh_dataset_cache():
-    global _dataset_cache
-    _dataset_cache = None
-    return _load_dataset()
+    return _store.load()
+
+_stamp = (None, None)  # (versions, stamp)
+
+def _data_version():
+    """
+    إصدار البيانات اللي الردود المخزنة في الكاش اتبنت عليها.
+    مبني على توقيع الملفات (mtime/inode/size) مش عداد داخلي، فبيفضل ثابت بعد إعادة التشغيل
+    وده اللي بيخلي كاش الردود المحفوظ على القرص صالح لو البيانات ماتغيرتش.
+    """
+    global _stamp
+    versions = _watcher.versions()
+    if _stamp[0] != versions:
+        sigs = [(name, (_watcher.get(name).signature if _watcher.get(name) else None))
+                for name in ("kb", "dataset", "model")]
+        _stamp = (versions, hashlib.sha1(repr(sigs).encode("utf-8")).hexdigest()[:16])
+    return _stamp[1]
 
 # ------------------------
 # memory helpers
@@ -145,6 +184,7 @@ def load_memory():
 def save_memory(mem):
     with _mem_lock:
         _write_json(MEM_PATH, mem)
+        get_history().update(mem)
 
 # ------------------------
 # حفظ زوج جديد (سؤال -> إجابة)
@@ -154,25 +194,16 @@ def save_new_pair(question: str, answer: str, session_id: str = None):
     answer = answer.strip()
     if not question or not answer:
         return False
-    # تجنب التكرار
-    dataset = _load_dataset()
-    if (question, answer) in dataset:
-        logging.info("pair already exists, skipping save")
-        return False
-    # اكتب في CSV
-    with _ds_lock:
-        try:
-            file_exists = DS_PATH.exists()
-            with open(DS_PATH, "a", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow(["question", "answer"])
-                writer.writerow([question, answer])
-            logging.info(f"[LEARN] saved pair: {question} -> {answer}")
-            _refresh_dataset_cache()
-        except Exception as e:
-            logging.warning(f"failed to append dataset: {e}")
+    # اكتب في CSV (مع تجنب التكرار — فحص O(1) في المخزن)
+    try:
+        if not _store.append(question, answer, dedupe=True):
+            log.info("pair already exists, skipping save")
             return False
+        log_event(log, "learn", "[LEARN] saved pair", q_len=len(question), a_len=len(answer))
+        log.debug("[LEARN] %s -> %s", question, answer)
+    except Exception as e:
+        log.warning(f"failed to append dataset: {e}")
+        return False
     # أضف أيضاً للذاكرة
     try:
         mem = load_memory()
@@ -190,55 +221,75 @@ def save_new_pair(question: str, answer: str, session_id: str = None):
         })
         save_memory(mem)
     except Exception as e:
-        logging.warning(f"failed to add to memory: {e}")
+        log.warning(f"failed to add to memory: {e}")
     # تحديث KB تلقائي بسيط: إذا السؤال قصير، ضمه كمفتاح
     try:
         if len(question.split()) <= 5:
             with _kb_lock:
-                kb = _load_kb()
+                kb = dict(_load_kb())  # اللقطة مشتركة: لا تعدلها مباشرة
                 if question not in kb:
                     kb[question] = answer
-                    _write_json = lambda p,d: open(p,"w",encoding="utf-8").write(json.dumps(d, ensure_ascii=False, indent=2))
                     _write_json(KB_PATH, kb)
-                    global _kb_cache
-                    _kb_cache = kb
+                    _watcher.refresh("kb")
     except Exception as e:
-        logging.warning(f"failed to update kb: {e}")
+        log.warning(f"failed to update kb: {e}")
 
     # خيار إعادة تدريب تلقائي إن كان مفعلاً
-    cfg = _read_json(CONFIG_PATH, {})
-    if cfg.get("auto_retrain"):
-        try:
-            threading.Thread(target=lambda: os.system(f'"{os.sys.executable}" "{ROOT/"train.py"}"'), daemon=True).start()
-        except Exception as e:
-            logging.warning(f"failed to trigger retrain: {e}")
+    if _config().get("auto_retrain"):
+        trigger_retrain()
 
     return True
 
+# ------------------------
+# إعادة التدريب في الخلفية (عملية train.py واحدة بس في أي وقت)
+# ------------------------
+_train_proc = None
+_train_lock = threading.Lock()
+
+def trigger_retrain():
+    """بيتحط في BackgroundWorker؛ الطلبات المتكررة قبل ما يبدأ بتتدمج في تشغيل واحد."""
+    return admission.defer("retrain", _start_training, key="retrain")
+
+def _start_training():
+    global _train_proc
+    with _train_lock:
+        if _train_proc is not None and _train_proc.poll() is None:
+            log.info("[TRAIN] training already running, skipped")
+            return
+        # train_streaming في config: تدريب out-of-core بالـ hashing (train.py --streaming)
+        cmd = [sys.executable, str(ROOT / "train.py")]
+        if _config().get("train_streaming"):
+            cmd.append("--streaming")
+        _train_proc = subprocess.Popen(cmd)
+        log.info(f"[TRAIN] started train.py (pid {_train_proc.pid})")
+
 # ------------------------
 # استرجاع من الذاكرة
 # ------------------------
 def retrieve(user_text: str, session_id: str = None):
-    mem = load_memory()
+    return _retrieve_scored(user_text, session_id)[0]
+
+def _retrieve_scored(user_text: str, session_id: str = None):
+    # الرسائل من الجدول المضغوط المشترك (history.py) بدل قراءة memory.json مع كل طلب
     best = None; best_score = 0.0
-    for sess in mem.get("sessions", []):
-        if session_id and sess.get("id") != session_id:
-            continue
-        for conv in sess.get("messages", []):
-            s = _similarity(user_text, conv.get("user_text", ""))
-            if s > best_score:
-                best_score = s
-                best = conv
+    for question, bot_text in get_history().table.pairs(session_id):
+        s = _similarity(user_text, question)
+        if s > best_score:
+            best_score = s
+            best = bot_text
     if best and best_score >= SIMILARITY_THRESHOLD_RETRIEVE:
         # تم استبدال وسم اللوج إلى وسم أبسط "[MEM]" بدلاً من "[RETRIEVE]"
-        logging.info(f"[MEM] score={best_score:.2f}")
-        return best.get("bot_text")
-    return None
+        log_event(log, "tier", "[MEM] match", tier="memory", score=round(best_score, 3))
+        return best, best_score
+    return None, best_score
 
 # ------------------------
 # dataset lookup (direct match by similarity)
 # ------------------------
 def dataset_lookup(user_text: str):
+    return _dataset_lookup_scored(user_text)[0]
+
+def _dataset_lookup_scored(user_text: str):
     dataset = _load_dataset()
     best_score = 0.0; best_answer = None
     for q,a in dataset:
@@ -246,9 +297,9 @@ def dataset_lookup(user_text: str):
         if s > best_score:
             best_score = s; best_answer = a
     if best_answer and best_score >= SIMILARITY_THRESHOLD_DATASET:
-        logging.info(f"[DATASET] match score={best_score:.2f}")
-        return best_answer
-    return None
+        log_event(log, "tier", "[DATASET] match", tier="dataset", score=round(best_score, 3))
+        return best_answer, best_score
+    return None, best_score
 
 # ------------------------
 # KB lookup
@@ -258,7 +309,7 @@ def kb_lookup(user_text: str):
     text = _clean_text(user_text)
     for key, val in kb.items():
         if key and _clean_text(key) in text:
-            logging.info(f"[KB] matched key='{key}'")
+            log_event(log, "tier", "[KB] match", tier="kb", key_len=len(key))
             return val
     return None
 
@@ -271,10 +322,8 @@ def markov_fallback(seed: str, n: int = MARKOV_N, max_len: int = MARKOV_MAX_LEN)
     for q,a in _load_dataset():
         corpus.append(q); corpus.append(a)
     # from memory
-    mem = load_memory()
-    for sess in mem.get("sessions", []):
-        for m in sess.get("messages", []):
-            corpus.append(m.get("user_text","")); corpus.append(m.get("bot_text",""))
+    for u, b in get_history().table.pairs():
+        corpus.append(u); corpus.append(b)
     text = " ".join([c for c in corpus if c])
     tokens = _clean_text(text).split()
     if len(tokens) < n:
@@ -302,17 +351,18 @@ def markov_fallback(seed: str, n: int = MARKOV_N, max_len: int = MARKOV_MAX_LEN)
 # ------------------------
 def try_ml_model(user_text: str):
     try:
-        if MODEL_PATH.exists():
-            vec, model = pickle.load(open(MODEL_PATH, "rb"))
-            Xv = vec.transform([user_text])
-            pred = model.predict(Xv)
-            if pred and len(pred) > 0:
-                logging.info("[ML] model returned an answer")
-                return pred[0]
+        answer = _ml.predict(user_text)
+        if answer:
+            log_event(log, "tier", "[ML] model returned an answer", tier="ml")
+            return answer
     except Exception as e:
-        logging.warning(f"ML error: {e}")
+        log.warning(f"ML error: {e}")
     return None
 
+def ml_status() -> dict:
+    """حالة النموذج المقيم: صفوف التدريب، المضاف بعده، ونسبة الـ drift."""
+    return _ml.status()
+
 # ------------------------
 # واجهات pending management للعمل مع app.py
 # ------------------------
@@ -337,15 +387,94 @@ def provide_answer_for_pending(session_id: str, answer: str):
 # الكاش: قراءة وكتابة
 # ------------------------
 def _cache_get(user_text: str):
-    return _reply_cache.get(_clean_text(user_text))
+    entry = _reply_cache.get(_clean_text(user_text))
+    if entry and entry[0] == _data_version():
+        return entry[1]
+    return None
 
 def _cache_set(user_text: str, reply: str):
-    _reply_cache[_clean_text(user_text)] = reply
+    global _cache_dirty
+    _reply_cache[_clean_text(user_text)] = (_data_version(), reply)
+    _cache_dirty = True
+
+# ------------------------
+# الكاش على القرص: تحميل عند البدء، وحفظ دوري وعند الإغلاق
+# ------------------------
+_cache_dirty = False
+_cache_saver = None
+
+def load_reply_cache():
+    """يحمل الكاش المحفوظ ويتجاهل أي رد اتبنى على إصدار بيانات أقدم."""
+    data = _read_json(REPLY_CACHE_PATH, None) if REPLY_CACHE_PATH.exists() else None
+    if not isinstance(data, dict):
+        return 0
+    stamp = _data_version()
+    loaded = dropped = 0
+    for key, entry in (data.get("entries") or {}).items():
+        if isinstance(entry, list) and len(entry) == 2 and entry[0] == stamp:
+            _reply_cache.setdefault(key, (entry[0], entry[1]))
+            loaded += 1
+        else:
+            dropped += 1
+    log.info(f"[CACHE] loaded {loaded} replies from disk (dropped {dropped} stale)")
+    return loaded
+
+def save_reply_cache(force: bool = False):
+    global _cache_dirty
+    if not (_cache_dirty or force):
+        return False
+    _cache_dirty = False
+    stamp = _data_version()
+    entries = {k: [v[0], v[1]] for k, v in dict(_reply_cache).items() if v[0] == stamp}
+    try:
+        tmp = REPLY_CACHE_PATH.with_suffix(".json.tmp")
+        _write_json(tmp, {"stamp": stamp, "saved_at": _now_ts(), "entries": entries})
+        os.replace(tmp, REPLY_CACHE_PATH)
+        log.info(f"[CACHE] saved {len(entries)} replies to disk")
+        return True
+    except Exception as e:
+        _cache_dirty = True
+        log.warning(f"failed to save reply cache: {e}")
+        return False
+
+def _cache_saver_loop():
+    while True:
+        time.sleep(float(_config().get("reply_cache_save_interval", REPLY_CACHE_SAVE_INTERVAL)))
+        save_reply_cache()
+
+def _start_cache_saver():
+    global _cache_saver
+    if _cache_saver is None:
+        _cache_saver = threading.Thread(target=_cache_saver_loop, name="reply-cache-saver", daemon=True)
+        _cache_saver.start()
+        atexit.register(save_reply_cache)
+
+def prewarm(questions) -> int:
+    """
+    يحسب ردود الأسئلة الأكثر تكراراً مسبقاً ويحطها في الكاش.
+    مابيسجلش pending للأسئلة اللي مالهاش إجابة (محدش مستني رد).
+    """
+    warmed = 0
+    for q in questions:
+        if not q or _cache_get(q):
+            continue
+        try:
+            ans, tier, _ = _generate_reply(q, None, 0, [], register_pending=False)
+        except Exception as e:
+            log.warning(f"[PREWARM] failed for question: {e}")
+            continue
+        if tier not in ("teach", "busy"):
+            warmed += 1
+    log.info(f"[PREWARM] warmed {warmed}/{len(questions)} questions")
+    return warmed
 
 # ------------------------
 # الدالة الرئيسية: توليد الرد
 # ------------------------
-def generate_reply(user_text: str, session_id: str = None) -> str:
+TEACH_PROMPT = "🤔 مش متأكد من الإجابة، ممكن تقولّي الإجابة الصح علشان أتعلمها؟"
+BUSY_PROMPT = "⏳ مش قادر أدوّر على إجابة دلوقتي، جرّب تسأل تاني كمان شوية."
+
+def generate_reply(user_text: str, session_id: str = None, budget_ms: float = None) -> str:
     """
     ترتيب المحاولات:
     1) cache
@@ -354,53 +483,167 @@ def generate_reply(user_text: str, session_id: str = None) -> str:
     4) dataset lookup
     5) ML model
     6) (Markov مُعطّل هنا)
-    7) Ask user to teach (register pending)
+    7) Ask user to teach (register pending) — أو BUSY_PROMPT لو طبقات اتخطت بسبب الوقت
+    الطبقات 3-5 بتشتغل على worker pool بحد زمني لكل طبقة وميزانية للطلب كله.
+    """
+    return generate_reply_meta(user_text, session_id, budget_ms)[0]
+
+def generate_reply_meta(user_text: str, session_id: str = None, budget_ms: float = None):
+    """
+    نفس generate_reply لكن يرجع (reply, meta)
+    meta = {"tier": cache|kb|memory|dataset|ml|teach|busy|invalid, "latency_ms": ..., "score": ...,
+            "budget_ms": ..., "skipped": [الطبقات اللي اتخطت بسبب الوقت], "failed": [طبقات رمت exception]}
+    budget_ms=None يستخدم reply_budget_ms من config، و 0 يلغي الحد.
     """
     if not user_text or not isinstance(user_text, str):
-        return "معلش مش قادر أجاوب دلوقتي."
+        return "معلش مش قادر أجاوب دلوقتي.", {"tier": "invalid", "latency_ms": 0.0}
+
+    if budget_ms is None:
+        budget_ms = _config().get("reply_budget_ms", REPLY_BUDGET_MS)
+    start = time.perf_counter()
+    skipped, failed = [], []
+    with profiling.profile_request("generate_reply"):
+        reply, tier, score = _generate_reply(user_text, session_id, budget_ms, skipped, failed=failed)
+    meta = {"tier": tier, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+    if score is not None:
+        meta["score"] = round(score, 3)
+    if budget_ms:
+        meta["budget_ms"] = budget_ms
+    if skipped:
+        meta["skipped"] = skipped
+    if failed:
+        meta["failed"] = failed
+    log_event(log, "reply", "[REPLY]", session=session_id, **meta)
+    return reply, meta
 
+# ------------------------
+# الطبقات المكلفة: worker pool + حد زمني
+# ------------------------
+_tier_pool = None
+_tier_pool_lock = threading.Lock()
+
+def _get_tier_pool():
+    global _tier_pool
+    with _tier_pool_lock:
+        if _tier_pool is None:
+            workers = int(_config().get("tier_workers", TIER_WORKERS))
+            _tier_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tier")
+    return _tier_pool
+
+def _ml_scored(user_text: str):
+    return try_ml_model(user_text), None
+
+def _expensive_tiers(user_text: str, session_id: str = None):
+    # بالترتيب: الأرخص والأدق أولاً
+    return [
+        ("memory", lambda: _retrieve_scored(user_text, session_id)),
+        ("dataset", lambda: _dataset_lookup_scored(user_text)),
+        ("ml", lambda: _ml_scored(user_text)),
+    ]
+
+def _run_tiers(user_text: str, session_id: str, budget_ms: float, skipped: list, failed: list):
+    """
+    يشغل الطبقات بالترتيب على الـ pool. كل طبقة تستنى min(حدها، الباقي من الميزانية).
+    الطبقة اللي وقتها خلص تتسجل في skipped، ولو خلصت بعدين بإجابة تتاخد كأفضل مرشح.
+    الطبقة اللي رمت exception تتسجل في failed.
+    يرجع (answer, tier, best_score).
+    """
+    limits = dict(TIER_BUDGETS_MS)
+    limits.update(_config().get("tier_budgets_ms") or {})
+    deadline = time.perf_counter() + budget_ms / 1000.0 if budget_ms else None
+    pool = _get_tier_pool()
+    late = []  # [(name, future)] طبقات اتخطت لكن ممكن تخلص
+    best_score = 0.0
+
+    def _late_answer():
+        for name, fut in late:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                ans, score = fut.result()
+                if ans:
+                    return ans, name, score
+        return None
+
+    for name, fn in _expensive_tiers(user_text, session_id):
+        found = _late_answer()
+        if found:
+            return found
+        timeout = limits.get(name)
+        timeout = timeout / 1000.0 if timeout else None
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                skipped.append(name)
+                continue
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        fut = pool.submit(profiling.traced(fn))  # الطبقة في cProfile الطلب لو عليه عينة
+        try:
+            ans, score = fut.result(timeout=timeout)
+        except FutureTimeout:
+            skipped.append(name)
+            if not fut.cancel():
+                late.append((name, fut))
+            log_event(log, "tier", "[TIER] timed out", tier=name, limit_ms=round((timeout or 0) * 1000, 1))
+            continue
+        except Exception as e:
+            failed.append(name)
+            log.warning(f"[TIER] {name} failed: {e}")
+            continue
+        if score is not None:
+            best_score = max(best_score, score)
+        if ans:
+            return ans, name, score
+    found = _late_answer()
+    if found:
+        return found
+    return None, None, best_score
+
+def _generate_reply(user_text: str, session_id: str = None, budget_ms: float = 0, skipped: list = None,
+                    register_pending: bool = True, failed: list = None):
+    """يرجع (reply, tier, score) — score لطبقات التشابه فقط."""
+    if skipped is None:
+        skipped = []
+    if failed is None:
+        failed = []
+    # الطبقات الرخيصة inline
     # cache
     c = _cache_get(user_text)
     if c:
-        logging.info("[CACHE] hit")
-        return c
+        log_event(log, "tier", "[CACHE] hit", tier="cache")
+        return c, "cache", None
 
     # KB
     kb_ans = kb_lookup(user_text)
     if kb_ans:
         _cache_set(user_text, kb_ans)
-        return kb_ans
-
-    # memory retrieval
-    mem_ans = retrieve(user_text, session_id)
-    if mem_ans:
-        _cache_set(user_text, mem_ans)
-        return mem_ans
-
-    # dataset lookup
-    ds_ans = dataset_lookup(user_text)
-    if ds_ans:
-        _cache_set(user_text, ds_ans)
-        return ds_ans
-
-    # ML
-    ml_ans = try_ml_model(user_text)
-    if ml_ans:
-        _cache_set(user_text, ml_ans)
-        return ml_ans
+        return kb_ans, "kb", None
+
+    # memory retrieval -> dataset lookup -> ML
+    ans, tier, score = _run_tiers(user_text, session_id, budget_ms, skipped, failed)
+    if ans:
+        # إجابة جت بعد ما طبقة أعلى اتخطت أو فشلت: ماتتخزنش في الكاش عشان الطلب الجاي يجرب الكل
+        if not skipped and not failed:
+            _cache_set(user_text, ans)
+        return ans, tier, score
+
+    # طبقات اتخطت بسبب الوقت أو فشلت: ممكن يكون عندنا الإجابة، فمانطلبش تعليم
+    # (الرد الجاي كان هيتحفظ كإجابة)
+    if skipped or failed:
+        log_event(log, "tier", "[BUSY]", session=session_id, skipped=len(skipped), failed=len(failed))
+        return BUSY_PROMPT, "busy", score
 
     # Markov fallback مُعطّل: لا نستخدمه لإعطاء رد عشوائي
     # إذا لايوجد شيء مناسب -> نسجل كـ pending ونطلب من المستخدم يساعدنا بالتعليم
+    if not register_pending:
+        return TEACH_PROMPT, "teach", score
     sid = session_id or str(_now_ts())
     _pending[sid] = user_text
-    logging.info(f"[TEACH_REQUEST] session={sid} question='{user_text}'")
-    return "🤔 مش متأكد من الإجابة، ممكن تقولّي الإجابة الصح علشان أتعلمها؟"
+    log_event(log, "teach", "[TEACH_REQUEST]", session=sid, q_len=len(user_text))
+    log.debug("[TEACH_REQUEST] session=%s question='%s'", sid, user_text)
+    return TEACH_PROMPT, "teach", score
 
 # ------------------------
 # init load
 # ------------------------
-_load_kb = _load_kb  # alias to load at import time
-_load_dataset = _load_dataset
-_load_kb()
-_load_dataset()
-logging.info("ai_engine initialized.")
+load_reply_cache()
+_start_cache_saver()
+log.info("ai_engine initialized.")
@@ -11,7 +11,9 @@ Features added:
 - better stats (top questions, learned count)
 - input filtering (bad words)
 - persistent last_session tracking
+- admission control: bounded in-flight chat/admin requests, 429/503 with Retry-After (admission.py)
 """
+import atexit
 import threading
 import webview
 import time
@@ -21,30 +23,30 @@ import datetime
 import csv
 import logging
 import shutil
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, send_file
 from pathlib import Path
-from collections import Counter
+
+import profiling
+import admission
+import channels
+import log_pipeline
+from log_pipeline import log_event
+from watcher import get_watcher, current_config
+from corpus_store import get_store
+from history import get_history
 
 ROOT = Path(__file__).parent
-DATA_DIR = ROOT / "data"
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
 MEM_PATH = DATA_DIR / "memory.json"
 CONFIG_PATH = DATA_DIR / "config.json"
 CSV_PATH = DATA_DIR / "dataset.csv"
-MODEL_PATH = ROOT / "model" / "khalid_model.pkl"
+MODEL_DIR = Path(os.environ.get("AI_KHALED_MODEL_DIR") or ROOT / "model")
+MODEL_PATH = MODEL_DIR / "khalid_model.pkl"
 BACKUP_DIR = DATA_DIR / "backups"
 KB_PATH = DATA_DIR / "kb.json"
 LAST_SESSION_PATH = DATA_DIR / "last_session.txt"
 LOG_PATH = DATA_DIR / "logs.txt"
 
-# ------------------------
-# Logging setup
-# ------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler(LOG_PATH, encoding="utf-8"), logging.StreamHandler()]
-)
-
 app = Flask(__name__, template_folder="templates", static_folder="assets")
 
 # ------------------------
@@ -53,6 +55,11 @@ app = Flask(__name__, template_folder="templates", static_folder="assets")
 for p in [DATA_DIR, BACKUP_DIR]:
     p.mkdir(parents=True, exist_ok=True)
 
+# ------------------------
+# Logging setup (queue + background writer, JSON file with rotation, see log_pipeline.py)
+# ------------------------
+log = log_pipeline.setup_logging(LOG_PATH, fmt="[%(asctime)s] [%(levelname)s] %(message)s")
+
 def ensure_json(path, default):
     if not path.exists():
         path.write_text(json.dumps(default, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -73,31 +80,20 @@ if not LAST_SESSION_PATH.exists():
 # ------------------------
 # Locks for safe concurrent writes
 # ------------------------
-_csv_lock = threading.Lock()
 _mem_lock = threading.Lock()
 _config_lock = threading.Lock()
 
 # ------------------------
-# Load dataset into memory (cache)
+# Dataset in memory (shared with ai_engine, see corpus_store.py)
+# config / kb / dataset / model are watched for external edits (see watcher.py)
 # ------------------------
-def load_dataset():
-    pairs = []
-    if CSV_PATH.exists():
-        with open(CSV_PATH, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader, None)
-            for row in reader:
-                if len(row) >= 2:
-                    q = row[0].strip()
-                    a = row[1].strip()
-                    if q and a:
-                        pairs.append((q, a))
-    return pairs
-
-_dataset_cache = load_dataset()  # kept in memory; updated on writes
-def refresh_dataset_cache():
-    global _dataset_cache
-    _dataset_cache = load_dataset()
+_watcher = get_watcher()
+_store = get_store()  # appends are incremental; external edits trigger a full reload
+_history = get_history()  # per-session message index for /api/history
+_watcher.subscribe("config", lambda snap: profiling.configure(snap.data or {}))
+_watcher.subscribe("config", lambda snap: log_pipeline.configure(snap.data or {}))
+_watcher.subscribe("config", lambda snap: admission.configure(snap.data or {}))
+_watcher.subscribe("config", lambda snap: channels.configure(snap.data or {}))
 
 # ------------------------
 # Utilities
@@ -121,44 +117,149 @@ def write_json(path, data):
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 def append_csv_pair(question, answer):
-    # writes with lock and avoids duplicate header
-    with _csv_lock:
-        exists = CSV_PATH.exists()
-        with open(CSV_PATH, "a", encoding="utf-8", newline="") as f:
-            writer = csv.writer(f)
-            if not exists:
-                writer.writerow(["question", "answer"])
-            writer.writerow([question, answer])
-        refresh_dataset_cache()
+    # one row appended to the file and to the shared store (no re-parse)
+    _store.append(question, answer)
 
 def save_memory(mem):
     with _mem_lock:
         write_json(MEM_PATH, mem)
+        _history.update(mem)
+
+def resident_session(session_id):
+    """
+    The session's channel with its session loaded from memory.json (once per channel).
+    Turns on that session then read and update ch.session in memory; flush_later() writes it back.
+    """
+    ch = channels.get_channel(session_id)
+    with ch.lock:
+        if ch.session is None:
+            mem = read_json(MEM_PATH) or {"sessions": []}
+            stored = next((s for s in mem["sessions"] if s.get("id") == session_id), None)
+            if stored is None:
+                set_last_session_id(session_id)
+                stored = {}
+            ch.session = {"id": session_id, "messages": list(stored.get("messages") or [])}
+            if stored.get("awaiting_answer"):
+                ch.session["awaiting_answer"] = stored["awaiting_answer"]
+            ch.flushed = len(ch.session["messages"])
+    return ch
+
+_flush_timer = None
+_flush_lock = threading.Lock()
+
+def flush_later(ch):
+    # one flush per channels flush_ms, however many turns happened in between
+    global _flush_timer
+    ch.dirty = True
+    with _flush_lock:
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(channels.flush_delay(), _flush_due)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+def _flush_due():
+    global _flush_timer
+    with _flush_lock:
+        _flush_timer = None
+    admission.defer("memory_flush", flush_sessions, key="memory_flush")
+
+def flush_sessions():
+    """
+    Write resident sessions back to memory.json: one read and one write for every changed session.
+    Only messages added since the last flush are appended, so entries written by others
+    (ai_engine.save_new_pair, /api/teach) are kept.
+    """
+    dirty = channels.take_dirty()
+    if not dirty:
+        return
+    with _mem_lock:
+        mem = read_json(MEM_PATH) or {"sessions": []}
+        for ch in dirty:
+            with ch.lock:
+                if ch.session is None:
+                    continue
+                new = ch.session["messages"][ch.flushed:]
+                ch.flushed += len(new)
+                awaiting = ch.session.get("awaiting_answer")
+            stored = next((s for s in mem["sessions"] if s.get("id") == ch.session_id), None)
+            if stored is None:
+                stored = {"id": ch.session_id, "messages": []}
+                mem["sessions"].append(stored)
+            stored.setdefault("messages", []).extend(new)
+            if awaiting:
+                stored["awaiting_answer"] = awaiting
+            else:
+                stored.pop("awaiting_answer", None)
+        write_json(MEM_PATH, mem)
+        _history.update(mem)
 
-def get_last_session_id():
+# the window can close right after a reply: write resident sessions before the process exits
+atexit.register(flush_sessions)
+
+def _read_last_session_id():
     try:
         return LAST_SESSION_PATH.read_text(encoding="utf-8").strip()
     except Exception:
         return ""
 
+# last_session.txt is read once; after that the value is served from memory
+# (asgi_app calls get_last_session_id() on the event loop)
+_last_session_id = _read_last_session_id()
+
+def get_last_session_id():
+    return _last_session_id
+
 def set_last_session_id(sid):
+    global _last_session_id
+    _last_session_id = str(sid)
     try:
         LAST_SESSION_PATH.write_text(str(sid), encoding="utf-8")
     except Exception:
         pass
 
 def trigger_train_background():
-    try:
-        logging.info("🚀 تشغيل train.py في الخلفية...")
-        threading.Thread(target=lambda: os.system(f'"{os.sys.executable}" "{ROOT/"train.py"}"'), daemon=True).start()
-    except Exception as e:
-        logging.warning(f"فشل تشغيل التدريب في الخلفية: {e}")
+    # queued on the background worker; only one train.py runs at a time (see ai_engine.trigger_retrain)
+    import ai_engine
+    logging.info("🚀 تشغيل train.py في الخلفية...")
+    if not ai_engine.trigger_retrain():
+        logging.warning("فشل تشغيل التدريب في الخلفية: background queue full")
+
+def auto_learn(question, answer, session_id, retrain):
+    # runs on the background worker, after the chat reply has been sent
+    if _store.append(question, answer, dedupe=True):
+        log_event(log, "learn", "[AUTO_LEARN] auto-saved pair", session=session_id)
+        if retrain:
+            trigger_train_background()
 
 # ------------------------
 # Count learned pairs (from dataset file)
 # ------------------------
 def count_learned():
-    return len(_dataset_cache)
+    return len(_store)
+
+def question_counts():
+    # same frequency data used by /api/stats and the startup prewarm (counted on interned ids)
+    return _history.table.user_text_counts()
+
+# ------------------------
+# Warm start: load the engine (and its saved reply cache), then precompute
+# replies for the most frequent questions before reporting ready
+# ------------------------
+PREWARM_TOP_N = 20
+_ready = threading.Event()
+
+def warm_start():
+    try:
+        import ai_engine
+        n = int(current_config().get("prewarm_top_n", PREWARM_TOP_N))
+        if n > 0:
+            top = [q for q, _ in question_counts().most_common(n)]
+            ai_engine.prewarm(top)
+    except Exception as e:
+        logging.warning(f"[PREWARM] failed: {e}")
+    finally:
+        _ready.set()
+        logging.info("[READY] server is ready")
 
 # ------------------------
 # Flask routes
@@ -169,27 +270,51 @@ def index():
     greeting = "صباح الخير!" if hour < 12 else "مساء الخير!"
     return render_template("index.html", greeting=greeting)
 
+@app.errorhandler(admission.Rejected)
+def rejected(e):
+    # fast rejection under overload: the client should back off for Retry-After seconds
+    resp = jsonify({"error": e.reason, "gate": e.gate, "retry_after": e.retry_after})
+    resp.status_code = e.status
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
 @app.route("/api/chat", methods=["POST"])
+@admission.gated("chat")
 def chat():
-    data = request.get_json() or {}
+    with profiling.profile_request("chat"):
+        payload, status = handle_chat(request.get_json() or {})
+    return jsonify(payload), status
+
+def handle_chat(data):
+    """
+    The chat logic without Flask: takes the request JSON, returns (payload, status).
+    Shared by the Flask route above and the ASGI mode (asgi_app.py).
+    """
+    started = time.perf_counter()
     text_raw = data.get("text", "")
     text = clean_text(text_raw)
     if not text:
-        return jsonify({"error": "empty"}), 400
-
-    # load memory
-    mem = read_json(MEM_PATH) or {"sessions": []}
+        return {"error": "empty"}, 400
 
     session_id = data.get("session_id") or str(int(time.time()))
-    session = next((s for s in mem["sessions"] if s.get("id") == session_id), None)
-    if not session:
-        session = {"id": session_id, "messages": []}
-        mem["sessions"].append(session)
-        set_last_session_id(session_id)
+    ch = channels.get_channel(session_id, create=False)
+    if ch is not None:
+        # the session has a channel: use its resident copy, written back in the background
+        session = resident_session(session_id).session
+        persist = lambda: flush_later(ch)
+    else:
+        # load memory
+        mem = read_json(MEM_PATH) or {"sessions": []}
+        session = next((s for s in mem["sessions"] if s.get("id") == session_id), None)
+        if not session:
+            session = {"id": session_id, "messages": []}
+            mem["sessions"].append(session)
+            set_last_session_id(session_id)
+        persist = lambda: save_memory(mem)
 
     # check awaiting_answer flag in session (legacy support)
-    if session.get("awaiting_answer"):
-        question = session.pop("awaiting_answer")
+    question = session.pop("awaiting_answer", None)
+    if question:
         answer = text
         append_csv_pair(question, answer)
         # also add to memory messages
@@ -198,16 +323,19 @@ def chat():
             "user_text": question,
             "bot_text": answer
         })
-        save_memory(mem)
-        logging.info(f"[LEARN] (via chat) {question} -> {answer}")
+        persist()
+        log_event(log, "learn", "[LEARN] (via chat)", session=session_id,
+                  q_len=len(question), a_len=len(answer))
+        logging.debug("[LEARN] (via chat) %s -> %s", question, answer)
         # optionally retrain
-        cfg = read_json(CONFIG_PATH) or {}
+        cfg = current_config()
         if cfg.get("auto_retrain"):
             trigger_train_background()
-        return jsonify({"reply": "✅ تم الحفظ! شكراً لتعليمك لي ❤️", "session_id": session_id})
+        return {"reply": "✅ تم الحفظ! شكراً لتعليمك لي ❤️", "session_id": session_id,
+                "meta": {"tier": "learn"}}, 200
 
     # call ai_engine
-    from ai_engine import generate_reply, is_waiting_for_answer, provide_answer_for_pending
+    from ai_engine import generate_reply_meta, is_waiting_for_answer, provide_answer_for_pending
     # If ai_engine is using pending mechanism, check it
     try:
         # if engine expects answer and session already waiting, let app handle
@@ -221,26 +349,25 @@ def chat():
                     "user_text": text,
                     "bot_text": msg
                 })
-                save_memory(mem)
+                persist()
                 # retrain optional
-                cfg = read_json(CONFIG_PATH) or {}
+                cfg = current_config()
                 if cfg.get("auto_retrain"):
                     trigger_train_background()
-                return jsonify({"reply": msg, "session_id": session_id})
+                return {"reply": msg, "session_id": session_id, "meta": {"tier": "learn"}}, 200
     except Exception:
         # engine may not implement those helpers — ignore gracefully
         pass
 
     # normal reply
-    reply = generate_reply(text, session_id)
+    reply, meta = generate_reply_meta(text, session_id)
 
-    # If engine asked to teach (string contains special prompt) — detect and set awaiting
-    teach_prompts = ["ممكن تقول", "مش متأكد", "ماتعرفش", "ممكن تقولّي الإجابة"]
-    if any(p in reply for p in teach_prompts):
+    # If engine asked to teach — set awaiting (tier "busy" is a timeout, not a teach request)
+    if meta.get("tier") == "teach":
         session["awaiting_answer"] = text
-        save_memory(mem)
-        logging.info(f"[TEACH_REQUEST] session={session_id} question={text}")
-        return jsonify({"reply": reply, "session_id": session_id})
+        persist()
+        log_event(log, "teach", "[TEACH_REQUEST]", session=session_id, q_len=len(text))
+        return {"reply": reply, "session_id": session_id, "meta": meta, "teach": True}, 200
 
     # otherwise save conversation
     session["messages"].append({
@@ -248,20 +375,67 @@ def chat():
         "user_text": text,
         "bot_text": reply
     })
-    save_memory(mem)
+    persist()
 
     # Auto-learn: if enabled and reply is not from KB/model and user accepted auto save,
-    cfg = read_json(CONFIG_PATH) or {}
-    if cfg.get("auto_train") and reply and text and (text, reply) not in _dataset_cache:
-        # append automatically
-        append_csv_pair(text, reply)
-        logging.info(f"[AUTO_LEARN] auto-saved pair for '{text}'")
-
-        if cfg.get("auto_retrain"):
-            trigger_train_background()
+    cfg = current_config()
+    if cfg.get("auto_train") and reply and text and not _store.contains(text, reply):
+        # append automatically (off the request path)
+        admission.defer("auto_learn", auto_learn, text, reply, session_id, bool(cfg.get("auto_retrain")))
+
+    log_event(log, "chat", "[CHAT]", session=session_id,
+              tier=meta.get("tier"), score=meta.get("score"), engine_ms=meta.get("latency_ms"),
+              latency_ms=round((time.perf_counter() - started) * 1000, 2),
+              q_len=len(text), a_len=len(reply))
+    logging.debug("[CHAT] %s -> %s", text, reply)
+    return {"reply": reply, "session_id": session_id, "meta": meta}, 200
 
-    logging.info(f"[CHAT] {text} -> {reply}")
-    return jsonify({"reply": reply, "session_id": session_id})
+# ------------------------
+# Streaming channel (SSE): one open connection per session, messages sent by POST
+# and answered as "thinking" / "reply" / "teach" events (see channels.py)
+# ------------------------
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    session_id = request.args.get("session_id") or get_last_session_id() or str(int(time.time()))
+    resident_session(session_id)  # "ready" carries the session state (pending_teach)
+    try:
+        gen, close = channels.sse_stream(session_id)
+    except channels.TooManyConnections:
+        resp = jsonify({"error": "too many connections"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "5"
+        return resp
+    resp = Response(gen, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    resp.call_on_close(close)
+    return resp
+
+@app.route("/api/stream/send", methods=["POST"])
+@admission.gated("chat")
+def stream_send():
+    with profiling.profile_request("chat"):
+        payload, status = handle_stream_send(request.get_json() or {})
+    return jsonify(payload), status
+
+def handle_stream_send(data):
+    """
+    One chat turn on the session channel: "thinking" right away, then "reply" or "teach"
+    (or "error"). Also returns the payload, so a client whose stream dropped still gets the answer.
+    Shared by the Flask route above and the ASGI mode.
+    """
+    session_id = data.get("session_id") or str(int(time.time()))
+    client_id = data.get("client_id")
+    ch = resident_session(session_id)  # handle_chat uses ch.session instead of re-reading memory.json
+    ch.publish("thinking", {"client_id": client_id})
+    payload, status = handle_chat(dict(data, session_id=session_id))
+    if status != 200:
+        payload["event_id"] = ch.publish("error", dict(payload, client_id=client_id))
+        return payload, status
+    # the pending question itself lives in ch.session ("awaiting_answer")
+    event = "teach" if payload.get("teach") else "reply"
+    payload["epoch"] = ch.epoch
+    payload["event_id"] = ch.publish(event, dict(payload, client_id=client_id, pending_teach=ch.pending_teach))
+    return payload, status
 
 # ------------------------
 # Teach endpoint (explicit): client can call to provide answer for a pending question
@@ -288,27 +462,51 @@ def teach():
         "bot_text": answer
     })
     save_memory(mem)
-    cfg = read_json(CONFIG_PATH) or {}
+    cfg = current_config()
     if cfg.get("auto_retrain"):
         trigger_train_background()
-    logging.info(f"[TEACH_API] saved {question} -> {answer} (session={session_id})")
+    log_event(log, "learn", "[TEACH_API] saved", session=session_id,
+              q_len=len(question), a_len=len(answer))
     return jsonify({"status": "saved"})
 
+# ------------------------
+# History endpoint: the UI pages backwards through one session (see history.py)
+# ------------------------
+@app.route("/api/history", methods=["GET"])
+def history():
+    payload, status = handle_history(request.args)
+    return jsonify(payload), status
+
+def handle_history(args):
+    # args: any mapping of query parameters (Flask request.args or the ASGI query dict)
+    session_id = args.get("session_id") or get_last_session_id() or _history.last_session
+    try:
+        before = args.get("before")
+        before = int(before) if before not in (None, "") else None
+        limit = int(args.get("limit", 30))
+    except ValueError:
+        return {"error": "before and limit must be integers"}, 400
+    return _history.page(session_id, before=before, limit=limit), 200
+
 # ------------------------
 # Dataset management endpoints
 # ------------------------
 @app.route("/api/dataset", methods=["GET"])
+@admission.gated("admin")
 def dataset_list():
     # return first N pairs for UI (with option ?limit=all)
     limit = request.args.get("limit", "100")
-    pairs = _dataset_cache.copy()
+    table = _store.pairs
+    count = len(table)
     if limit != "all":
         try:
             limit = int(limit)
-            pairs = pairs[:limit]
+            pairs = table[:limit]
         except:
-            pairs = pairs[:100]
-    return jsonify({"count": len(_dataset_cache), "pairs": pairs})
+            pairs = table[:100]
+    else:
+        pairs = table[:]
+    return jsonify({"count": count, "pairs": pairs})
 
 @app.route("/api/dataset/add", methods=["POST"])
 def dataset_add():
@@ -328,24 +526,13 @@ def dataset_delete():
     a = data.get("answer", "").strip()
     if not q:
         return jsonify({"error": "question required"}), 400
-    # remove matching pairs
-    removed = 0
-    with _csv_lock:
-        pairs = load_dataset()
-        new_pairs = [p for p in pairs if not (p[0] == q and (not a or p[1] == a))]
-        if len(new_pairs) != len(pairs):
-            # overwrite file
-            with open(CSV_PATH, "w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(["question", "answer"])
-                for row in new_pairs:
-                    writer.writerow(list(row))
-            refresh_dataset_cache()
-            removed = len(pairs) - len(new_pairs)
+    # remove matching pairs (rewrites the file only if something matched)
+    removed = _store.remove(q, a)
     logging.info(f"[DATASET_DELETE] removed {removed} items for question='{q}'")
     return jsonify({"removed": removed})
 
 @app.route("/api/dataset/export", methods=["GET"])
+@admission.gated("admin")
 def dataset_export():
     # return CSV content to download
     def generate():
@@ -364,43 +551,40 @@ def manage_config():
         with _config_lock:
             cfg = read_json(CONFIG_PATH) or {}
             cfg.update(new_cfg)
-            write_json = lambda p,data: open(p,"w",encoding="utf-8").write(json.dumps(data, ensure_ascii=False, indent=2))
             write_json(CONFIG_PATH, cfg)
+            _watcher.refresh("config")
         logging.info(f"[CONFIG] updated: {new_cfg}")
         return jsonify({"status": "updated", "config": cfg})
     else:
-        cfg = read_json(CONFIG_PATH) or {}
-        return jsonify(cfg)
+        return jsonify(current_config())
 
 # ------------------------
 # Retrain trigger
 # ------------------------
 @app.route("/api/retrain", methods=["POST"])
+@admission.gated("admin")
 def retrain():
-    threading.Thread(target=trigger_train_background, daemon=True).start()
+    trigger_train_background()
     return jsonify({"status": "retraining started"})
 
 # ------------------------
 # Stats & backup & reset
 # ------------------------
 @app.route("/api/stats", methods=["GET"])
+@admission.gated("admin")
 def stats():
+    import ai_engine
     try:
-        mem = read_json(MEM_PATH) or {"sessions": []}
-        total_sessions = len(mem.get("sessions", []))
-        total_messages = sum(len(s.get("messages", [])) for s in mem.get("sessions", []))
+        table = _history.table
+        total_sessions = table.session_count
+        total_messages = len(table)
         # top questions
-        counter = Counter()
-        for s in mem.get("sessions", []):
-            for m in s.get("messages", []):
-                q = m.get("user_text", "")
-                if q:
-                    counter[q] += 1
-        top = counter.most_common(5)
+        top = question_counts().most_common(5)
         return jsonify({
             "sessions": total_sessions,
             "messages": total_messages,
             "learned_pairs": count_learned(),
+            "ml": ai_engine.ml_status(),
             "top_questions": top,
             "last_session": get_last_session_id()
         })
@@ -408,7 +592,14 @@ def stats():
         logging.error(f"Stats error: {e}")
         return jsonify({"error": "failed"}), 500
 
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    if not _ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True})
+
 @app.route("/api/backup", methods=["GET"])
+@admission.gated("admin")
 def backup():
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     created = []
@@ -428,29 +619,70 @@ def reset_all():
     if confirm != "yes":
         return jsonify({"error": "confirmation required: ?confirm=yes"}), 400
     # keep kb and config, reset memory and dataset
-    write_json = lambda p,data: open(p,"w",encoding="utf-8").write(json.dumps(data, ensure_ascii=False, indent=2))
-    write_json(MEM_PATH, {"sessions": []})
-    with _csv_lock:
-        with open(CSV_PATH, "w", encoding="utf-8", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["question", "answer"])
-        refresh_dataset_cache()
+    save_memory({"sessions": []})
+    channels.drop_sessions()
+    _store.reset()
     logging.warning("[RESET] system reset performed")
     return jsonify({"status": "reset"})
 
+# ------------------------
+# Admission counters (admin): queue depth / rejections for sizing workers
+# ------------------------
+@app.route("/api/admin/admission", methods=["GET"])
+def admission_stats():
+    return jsonify(dict(admission.stats(), channels=channels.stats()))
+
+# ------------------------
+# Profiling (admin)
+# ------------------------
+@app.route("/api/admin/profiling", methods=["GET", "POST"])
+def profiling_control():
+    if request.method == "POST":
+        data = request.get_json() or {}
+        # enabled: true/false يفرض الحالة، null يرجع لإعدادات config.json
+        if "enabled" in data:
+            profiling.set_override(data.get("enabled"))
+        logging.info(f"[PROFILE] override set: {data}")
+    return jsonify(profiling.status())
+
+@app.route("/api/admin/profiling/snapshot", methods=["POST"])
+def profiling_snapshot():
+    stacks = profiling.flush_sampler()
+    mem = profiling.memory_snapshot()
+    return jsonify({
+        "stacks": stacks.name if stacks else None,
+        "tracemalloc": mem.name if mem else None,
+    })
+
+@app.route("/api/admin/profiles", methods=["GET"])
+def profiles_list():
+    return jsonify({"profiles": profiling.list_profiles()})
+
+@app.route("/api/admin/profiles/<name>", methods=["GET"])
+def profiles_download(name):
+    path = profiling.profile_path(name)
+    if path is None:
+        return jsonify({"error": "not found"}), 404
+    if request.args.get("summary") and path.suffix == ".prof":
+        return Response(profiling.profile_summary(name), mimetype="text/plain")
+    return send_file(path, as_attachment=True, download_name=path.name)
+
 # ------------------------
 # Server & WebView
 # ------------------------
-def start_server():
-    cfg = read_json(CONFIG_PATH) or {}
+def start_server(port=5000, host="127.0.0.1"):
+    cfg = current_config()
     debug = cfg.get("debug", False)
-    app.run(port=5000, debug=debug)
+    threading.Thread(target=warm_start, name="warm-start", daemon=True).start()
+    app.run(host=host, port=port, debug=debug, use_reloader=False)
 
 if __name__ == "__main__":
+    profiling.install_signal_handler()
     threading.Thread(target=start_server, daemon=True).start()
     time.sleep(0.5)
     from server import start_server
     start_server()
+    _ready.wait(timeout=30)
     print("🚀 AI Khaled جاهز ومُحسّن على http://127.0.0.1:5000")
     webview.create_window("AI Khaled — Smart Edition", "http://127.0.0.1:5000", width=980, height=740)
     webview.start()
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+asgi_app.py — وضع تشغيل async (ASGI) لنفس الـ /api/*
+- event loop واحد بيمسك كل الاتصالات، فالعملاء البطيئين والاتصالات الفاضية مابيحجزوش threads.
+- /api/chat متنفذ هنا مباشرة: الطلب بياخد مكان في بوابة "chat" (admission.AsyncGate، الانتظار على الـ loop)
+  وبعدين handle_chat (نفس منطق app.py) بيشتغل في ThreadPool محدود، فحساب الـ similarity
+  و model.predict وقراءة/كتابة memory.json مابيوقفوش الـ loop.
+- /api/history و /api/ready من الذاكرة فبيتردوا على الـ loop.
+- /api/stream (SSE) متنفذ هنا كمان: الاتصال المفتوح مجرد coroutine مستنية على asyncio.Queue
+  (مش thread زي Flask)، و /api/stream/send بيشتغل زي /api/chat.
+- أي route تاني بيروح لتطبيق Flask نفسه (WSGI) في thread pool منفصل، فكل الـ endpoints موجودة في الوضعين.
+- lifespan startup بيشغل warm_start في الخلفية (/api/ready بيرجع 503 لحد ما يخلص).
+
+التشغيل:
+  uvicorn asgi_app:app --port 5000      # لو uvicorn متثبت
+  python asgi_app.py [--port 5000]      # uvicorn لو موجود، وإلا سيرفر HTTP/1.1 صغير على asyncio
+
+الإعدادات من config.json تحت "asgi":
+  {"workers": 8, "io_workers": 16, "max_body": 1048576}
+"""
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+import threading
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import app as web
+import profiling
+import admission
+import channels
+from watcher import current_config
+
+DEFAULTS = {
+    "workers": 8,        # threads لـ handle_chat (CPU + I/O الشات)
+    "io_workers": 16,    # threads لتطبيق Flask (باقي الـ routes)
+    "max_body": 1 << 20, # أقصى حجم body مقبول (بايت)
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _settings() -> dict:
+    section = current_config().get("asgi") or {}
+    out = dict(DEFAULTS)
+    if isinstance(section, dict):
+        out.update(section)
+    return out
+
+def _pool(kind: str) -> ThreadPoolExecutor:
+    # بيتعمل عند أول استخدام بالحجم اللي في config وقتها
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            size = max(1, int(_settings()[kind]))
+            pool = _pools[kind] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"asgi-{kind}")
+        return pool
+
+# ------------------------
+# Helpers
+# ------------------------
+class BodyTooLarge(Exception):
+    pass
+
+async def _read_body(receive) -> bytes:
+    limit = int(_settings()["max_body"])
+    chunks, size = [], 0
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            break
+        chunk = msg.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not msg.get("more_body"):
+            break
+    return b"".join(chunks)
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode("latin-1"))] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def _query(scope) -> dict:
+    return dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+
+# ------------------------
+# Native routes
+# ------------------------
+def _profiled(handler, data):
+    with profiling.profile_request("chat"):
+        return handler(data)
+
+async def _gated_chat(receive, send, handler):
+    # بوابة "chat" على الـ loop، وبعدين handler(data) -> (payload, status) في الـ pool
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        async with admission.async_gate("chat").slot():
+            loop = asyncio.get_running_loop()
+            payload, status = await loop.run_in_executor(_pool("workers"), _profiled, handler, data)
+    except admission.Rejected as e:
+        await _send_json(send, {"error": e.reason, "gate": e.gate, "retry_after": e.retry_after}, e.status,
+                         [(b"retry-after", str(e.retry_after).encode("latin-1"))])
+        return
+    await _send_json(send, payload, status)
+
+async def chat(scope, receive, send):
+    await _gated_chat(receive, send, web.handle_chat)
+
+async def stream_send(scope, receive, send):
+    await _gated_chat(receive, send, web.handle_stream_send)
+
+async def _wait_disconnect(receive):
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            return
+
+async def stream(scope, receive, send):
+    args = _query(scope)
+    session_id = args.get("session_id") or web.get_last_session_id() or str(int(time.time()))
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue(maxsize=channels.queue_size())
+
+    def _put(msg):
+        try:
+            events.put_nowait(msg)
+        except asyncio.QueueFull:
+            channels.count_dropped()
+
+    def deliver(msg):
+        # ممكن يتنادى من thread في الـ pool (handle_stream_send)
+        loop.call_soon_threadsafe(_put, msg)
+
+    # الجلسة بتتحمل من memory.json مرة للقناة (قراءة ملف: برة الـ loop)، و "ready" بيحمل حالتها
+    await loop.run_in_executor(_pool("workers"), web.resident_session, session_id)
+    try:
+        ch = channels.open_connection(session_id, deliver)
+    except channels.TooManyConnections:
+        await _send_json(send, {"error": "too many connections"}, 503, [(b"retry-after", b"5")])
+        return
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")],
+        })
+        await send({"type": "http.response.body", "body": channels.PRELUDE.encode("utf-8"), "more_body": True})
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, disconnected}, timeout=channels.heartbeat_interval(),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                msg = getter.result()
+            else:
+                getter.cancel()
+                if disconnected.done():
+                    break
+                msg = channels.HEARTBEAT
+            await send({"type": "http.response.body", "body": msg.encode("utf-8"), "more_body": True})
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        disconnected.cancel()
+        channels.close_connection(ch, deliver)
+
+async def history(scope, receive, send):
+    payload, status = web.handle_history(_query(scope))
+    await _send_json(send, payload, status)
+
+async def ready(scope, receive, send):
+    ok = web._ready.is_set()
+    await _send_json(send, {"ready": ok}, 200 if ok else 503)
+
+ROUTES = {
+    ("POST", "/api/chat"): chat,
+    ("GET", "/api/history"): history,
+    ("GET", "/api/ready"): ready,
+    ("GET", "/api/stream"): stream,
+    ("POST", "/api/stream/send"): stream_send,
+}
+
+# ------------------------
+# Fallback: تطبيق Flask (WSGI) في thread pool
+# ------------------------
+def _environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("127.0.0.1", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": str(client[0]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if key == "CONTENT_LENGTH":
+            continue
+        key = "HTTP_" + key
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+def _call_wsgi(environ):
+    response = {}
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return body.append
+
+    result = web.app(environ, start_response)
+    try:
+        for chunk in result:
+            if chunk:
+                body.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], b"".join(body)
+
+async def wsgi_fallback(scope, receive, send):
+    body = await _read_body(receive)
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(_pool("io_workers"), _call_wsgi, _environ(scope, body))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+# ------------------------
+# ASGI entry point
+# ------------------------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    handler = ROUTES.get((scope["method"], scope["path"]), wsgi_fallback)
+    try:
+        await handler(scope, receive, send)
+    except BodyTooLarge:
+        await _send_json(send, {"error": "request body too large"}, 413)
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            _start_warmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            for pool in list(_pools.values()):
+                pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+def _start_warmup():
+    threading.Thread(target=web.warm_start, name="warm-start", daemon=True).start()
+
+# ------------------------
+# سيرفر HTTP/1.1 صغير (لو uvicorn مش متثبت)
+# keep-alive، body بـ Content-Length، والرد chunked لو مافيهوش Content-Length.
+# ------------------------
+KEEPALIVE_TIMEOUT = 15
+
+def _write_error(writer, status: int, message: str):
+    # رد قبل ما الطلب يوصل للتطبيق (الـ body ماتقراش، فالاتصال بيتقفل بعده)
+    body = json.dumps({"error": message}).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n".encode("latin-1") +
+                 b"content-type: application/json; charset=utf-8\r\n" +
+                 f"content-length: {len(body)}\r\n".encode("latin-1") +
+                 b"connection: close\r\n\r\n" + body)
+
+async def _serve_connection(reader, writer, asgi, server_addr):
+    peer = writer.get_extra_info("peername") or ("", 0)
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            try:
+                method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+            except ValueError:
+                break
+            headers = []
+            while True:
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = h.decode("latin-1").partition(":")
+                headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+            hdr = {k: v for k, v in headers}
+            if b"chunked" in hdr.get(b"transfer-encoding", b"").lower():
+                writer.write(b"HTTP/1.1 411 Length Required\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+                break
+            try:
+                length = int(hdr.get(b"content-length", b"0") or 0)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                _write_error(writer, 400, "invalid content-length")
+                break
+            if length > int(_settings()["max_body"]):
+                # قبل القراءة: مانحجزش ذاكرة على قد الـ Content-Length اللي العميل بعته
+                _write_error(writer, 413, "request body too large")
+                break
+            body = await reader.readexactly(length) if length else b""
+            conn = hdr.get(b"connection", b"").lower()
+            keep_alive = (conn != b"close") if version == "HTTP/1.1" else (conn == b"keep-alive")
+
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": version[5:] or "1.1",
+                "method": method.upper(),
+                "scheme": "http",
+                "path": unquote(path),
+                "raw_path": path.encode("latin-1"),
+                "query_string": query.encode("latin-1"),
+                "root_path": "",
+                "headers": headers,
+                "server": server_addr,
+                "client": tuple(peer[:2]),
+            }
+            state = {"body_sent": False, "started": False, "chunked": False}
+
+            async def receive():
+                if not state["body_sent"]:
+                    state["body_sent"] = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                # بعد الـ body: استنى لحد ما العميل يقفل (الردود الطويلة زي SSE)
+                while await reader.read(65536):
+                    pass
+                return {"type": "http.disconnect"}
+
+            async def send(msg):
+                if msg["type"] == "http.response.start":
+                    state["started"] = True
+                    status = msg["status"]
+                    out_headers = list(msg.get("headers", []))
+                    names = {k.lower() for k, _ in out_headers}
+                    if b"content-length" not in names:
+                        state["chunked"] = True
+                        out_headers.append((b"transfer-encoding", b"chunked"))
+                    out_headers.append((b"connection", b"keep-alive" if keep_alive else b"close"))
+                    head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n".encode("latin-1")
+                    head += b"".join(k + b": " + v + b"\r\n" for k, v in out_headers) + b"\r\n"
+                    writer.write(head)
+                elif msg["type"] == "http.response.body":
+                    data = msg.get("body", b"")
+                    if state["chunked"]:
+                        if data:
+                            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+                        if not msg.get("more_body"):
+                            writer.write(b"0\r\n\r\n")
+                    elif data:
+                        writer.write(data)
+                    await writer.drain()
+
+            try:
+                await asgi(scope, receive, send)
+            except Exception as e:
+                logging.exception(f"[ASGI] unhandled error: {e}")
+                if not state["started"]:
+                    await _send_json(send, {"error": "internal error"}, 500)
+                else:
+                    break
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+async def serve(host="127.0.0.1", port=5000):
+    server = await asyncio.start_server(
+        lambda r, w: _serve_connection(r, w, app, (host, port)), host, port, backlog=4096)
+    _start_warmup()
+    logging.info(f"[ASGI] serving on http://{host}:{port} (built-in server)")
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="AI Khaled — async (ASGI) serving mode")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=5000)
+    ap.add_argument("--builtin", action="store_true", help="use the built-in asyncio server even if uvicorn is installed")
+    args = ap.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+    if uvicorn is not None and not args.builtin:
+        uvicorn.run(app, host=args.host, port=args.port, lifespan="on")
+    else:
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,19 +5,109 @@ document.addEventListener("DOMContentLoaded", function(){
   const btnTrain = document.getElementById("btn-train");
   const btnSave = document.getElementById("btn-save");
 
-  function addBubble(who, text){
+  // الجلسة الحالية: بتتحفظ عشان المحادثة تكمل في نفس الجلسة بعد إعادة الفتح
+  let sessionId = localStorage.getItem("ai_khaled_session") || "";
+  function setSession(sid){
+    if(sid && sid !== sessionId){
+      sessionId = sid;
+      localStorage.setItem("ai_khaled_session", sid);
+    }
+  }
+
+  function makeBubble(who, text){
     const d = document.createElement("div");
     d.className = "bubble " + (who==="user" ? "user" : "bot");
     d.textContent = (who==="user" ? "أنت: " : "AI Khaled: ") + text;
-    chat.appendChild(d);
+    return d;
+  }
+
+  function addBubble(who, text){
+    chat.appendChild(makeBubble(who, text));
+    chat.scrollTop = chat.scrollHeight;
+  }
+
+  // قناة الجلسة (SSE): الرد بيوصل كحدث، و "thinking" بيظهر أول ما الرسالة توصل للسيرفر.
+  // لو القناة مش مفتوحة بنرجع لـ /api/chat العادي.
+  let stream = null;
+  let clientSeq = 0;
+  const pending = {};        // client_id -> فقاعة الرد المستنية
+  const rendered = new Set(); // "epoch:event_id" اللي اتعرضت (الحدث أو رد الـ POST، اللي يوصل الأول)
+  let channelEpoch = null;     // القناة اتعملت من جديد (sweep أو restart) -> الأرقام بتبدأ من الأول
+  let shownPending = null;     // السؤال المستني تعليم اللي اتعرض للمستخدم
+
+  function pendingBubble(clientId){
+    let b = pending[clientId];
+    if(!b){
+      b = makeBubble("bot", "...");
+      pending[clientId] = b;
+      chat.appendChild(b);
+      chat.scrollTop = chat.scrollHeight;
+    }
+    return b;
+  }
+
+  function showReply(clientId, epoch, eventId, text){
+    const key = eventId ? epoch + ":" + eventId : null;
+    if(key && rendered.has(key)) return;
+    if(key) rendered.add(key);
+    const b = pendingBubble(clientId);
+    b.textContent = "AI Khaled: " + (text || "(خطأ)");
+    delete pending[clientId];
     chat.scrollTop = chat.scrollHeight;
   }
 
+  function openStream(){
+    if(!window.EventSource) return;
+    const params = new URLSearchParams();
+    if(sessionId) params.set("session_id", sessionId);
+    stream = new EventSource("/api/stream?" + params);
+    stream.addEventListener("ready", function(e){
+      const j = JSON.parse(e.data);
+      setSession(j.session_id);
+      if(j.epoch !== channelEpoch){
+        channelEpoch = j.epoch;
+        rendered.clear();
+      }
+      // السيرفر لسه مستني إجابة سؤال (الصفحة اتفتحت تاني أو الاتصال رجع): فكّر المستخدم مرة واحدة
+      if(j.pending_teach && j.pending_teach !== shownPending){
+        addBubble("bot", "لسه مستني إجابتك على: \"" + j.pending_teach + "\" — اكتبها في الرسالة الجاية.");
+      }
+      shownPending = j.pending_teach || null;
+    });
+    stream.addEventListener("teach", function(e){
+      shownPending = JSON.parse(e.data).pending_teach || shownPending;
+    });
+    stream.addEventListener("thinking", function(e){
+      pendingBubble(JSON.parse(e.data).client_id);
+    });
+    for(const name of ["reply", "teach", "error"]){
+      stream.addEventListener(name, function(e){
+        const j = JSON.parse(e.data);
+        showReply(j.client_id, j.epoch, Number(e.lastEventId), j.reply || j.error);
+      });
+    }
+  }
+
+  async function sendOnStream(text){
+    const clientId = "c" + (++clientSeq);
+    const res = await fetch("/api/stream/send", {method:"POST", headers:{"Content-Type":"application/json"},
+      body: JSON.stringify({text, session_id: sessionId || undefined, client_id: clientId})});
+    const j = await res.json();
+    setSession(j.session_id);
+    // الحدث عادة بيوصل قبل الرد ده؛ لو لأ (القناة اتقطعت) نعرض من هنا
+    showReply(clientId, j.epoch, j.event_id, j.reply || j.error);
+  }
+
   async function send(text){
     addBubble("user", text);
     try{
-      const res = await fetch("/api/chat", {method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({text})});
+      if(stream && stream.readyState === EventSource.OPEN){
+        await sendOnStream(text);
+        return;
+      }
+      const res = await fetch("/api/chat", {method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({text, session_id: sessionId || undefined})});
       const j = await res.json();
+      setSession(j.session_id);
       addBubble("bot", j.reply || "(خطأ)");
     }catch(e){
       addBubble("bot", "خطأ في الاتصال بالمحرك المحلي.");
@@ -44,15 +134,41 @@ document.addEventListener("DOMContentLoaded", function(){
     alert("تم حفظ الذاكرة في: " + j.path + "\\nحجم الملف: " + j.size + " بايت");
   });
 
-  // load last conversations to UI
-  (async function loadRecent(){
+  // history: آخر رسائل الجلسة عند الفتح، والأقدم لما المستخدم يطلع لفوق
+  let nextBefore = null;
+  let loadingHistory = false;
+
+  async function loadHistory(before){
+    if(loadingHistory) return;
+    loadingHistory = true;
     try{
-      const mem = await fetch("/data/memory.json").then(r=>r.json());
-      const convs = mem.conversations || [];
-      for(const c of convs.slice(-30)){
-        addBubble("user", c.user_text);
-        addBubble("bot", c.bot_text);
+      const params = new URLSearchParams({limit: "30"});
+      if(sessionId) params.set("session_id", sessionId);
+      if(before !== undefined && before !== null) params.set("before", String(before));
+      const j = await fetch("/api/history?" + params).then(r=>r.json());
+      if(j.session_id) setSession(j.session_id);
+      nextBefore = j.next_before;
+      const frag = document.createDocumentFragment();
+      for(const m of j.messages || []){
+        frag.appendChild(makeBubble("user", m.user_text));
+        frag.appendChild(makeBubble("bot", m.bot_text));
       }
-    }catch(e){}
-  })();
+      // prepend مع الحفاظ على مكان القراءة
+      const fromBottom = chat.scrollHeight - chat.scrollTop;
+      chat.insertBefore(frag, chat.firstChild);
+      chat.scrollTop = chat.scrollHeight - fromBottom;
+    }catch(e){
+    }finally{
+      loadingHistory = false;
+    }
+  }
+
+  chat.addEventListener("scroll", function(){
+    if(chat.scrollTop < 40 && nextBefore !== null){
+      loadHistory(nextBefore);
+    }
+  });
+
+  // القناة بتتفتح بعد الـ history عشان تبقى على نفس الجلسة
+  loadHistory().then(openStream);
 });
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+channels.py — قناة مفتوحة لكل جلسة (Server-Sent Events) للواجهة
+- Channel: حالة الجلسة مقيمة على السيرفر طول ما فيه اتصال مفتوح (وبعده بـ idle_ttl):
+  رقم آخر حدث، الجلسة نفسها (الرسائل و awaiting_answer)، والاتصالات المشتركة.
+  app.py بيحمل الجلسة من memory.json مرة واحدة للقناة، والرسائل بعد كده بتتعدل في الذاكرة
+  والجديد بس بيتكتب في الخلفية (flush) بدل قراءة/كتابة الملف كله مع كل رسالة.
+- الأحداث: "ready" عند الفتح، "thinking" أول ما الرسالة توصل، "reply" بالرد،
+  "teach" لما المحرك يطلب الإجابة من المستخدم، و "error".
+- الرسائل نفسها بتتبعت بـ POST (/api/stream/send)، والرد بيوصل كحدث على القناة.
+- كل اتصال بيسجل deliver callable: QueueSubscriber لـ Flask (thread لكل اتصال)،
+  و asgi_app بيسجل callable بيحط في asyncio.Queue، فنفس القناة شغالة في الوضعين.
+
+الإعدادات من config.json تحت "channels":
+  {"max_connections": 1000, "idle_ttl": 300, "heartbeat": 15, "queue_size": 100, "flush_ms": 500}
+"""
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+
+DEFAULTS = {
+    "max_connections": 1000, # أقصى اتصالات SSE مفتوحة في نفس الوقت
+    "idle_ttl": 300,         # ثواني تفضل فيها القناة بعد آخر اتصال اتقفل
+    "heartbeat": 15,         # ثواني بين تعليقات keep-alive
+    "queue_size": 100,       # أحداث مستنية لكل اتصال قبل ما نرمي
+    "flush_ms": 500,         # تأخير كتابة الجلسات المقيمة في memory.json (الرسائل المتتالية بتتجمع)
+}
+
+_settings = dict(DEFAULTS)
+
+class TooManyConnections(Exception):
+    pass
+
+def format_event(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+HEARTBEAT = ": ping\n\n"
+PRELUDE = "retry: 3000\n\n"  # EventSource يعيد الاتصال بعد 3 ثواني لو اتقطع
+
+class Channel:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.seq = 0
+        # seq بيبدأ من 1 مع كل قناة جديدة (sweep / restart): الواجهة بتميز الأحداث بـ (epoch, id)
+        self.epoch = uuid.uuid4().hex[:12]
+        self.session = None  # {"id", "messages", "awaiting_answer"} — بيحملها app.resident_session
+        self.flushed = 0     # عدد رسائل session اللي اتكتبت في memory.json
+        self.dirty = False   # فيه تغيير لسه ماتكتبش
+        self.lock = threading.Lock()  # تعديل session
+        self.opened_at = time.time()
+        self.last_active = self.opened_at
+        self._subs = []
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data: dict) -> int:
+        with self._lock:
+            self.seq += 1
+            event_id = self.seq
+            self.last_active = time.time()
+            subs = list(self._subs)
+        msg = format_event(event_id, event, dict(data, session_id=self.session_id, epoch=self.epoch))
+        for deliver in subs:
+            try:
+                deliver(msg)
+            except Exception as e:
+                logging.warning(f"[CHANNEL] deliver failed: {e}")
+        return event_id
+
+    def attach(self, deliver):
+        with self._lock:
+            self._subs.append(deliver)
+            self.last_active = time.time()
+
+    def detach(self, deliver):
+        with self._lock:
+            if deliver in self._subs:
+                self._subs.remove(deliver)
+            self.last_active = time.time()
+
+    @property
+    def connections(self) -> int:
+        return len(self._subs)
+
+    @property
+    def pending_teach(self):
+        """السؤال اللي المحرك طلب إجابته (لو فيه)."""
+        return (self.session or {}).get("awaiting_answer")
+
+    def state(self) -> dict:
+        return {"last_event_id": self.seq, "pending_teach": self.pending_teach}
+
+# ------------------------
+# Registry
+# ------------------------
+_channels = {}
+_lock = threading.Lock()
+_connections = 0
+_dropped = 0
+
+def get_channel(session_id: str, create: bool = True):
+    with _lock:
+        _sweep()
+        ch = _channels.get(session_id)
+        if ch is None and create:
+            ch = _channels[session_id] = Channel(session_id)
+        return ch
+
+def _sweep():
+    # قنوات مفيهاش اتصالات وعدى عليها idle_ttl (تحت _lock)؛ اللي فيها تغيير ماتكتبش تستنى الـ flush
+    ttl = float(_settings.get("idle_ttl", DEFAULTS["idle_ttl"]))
+    now = time.time()
+    for sid in [sid for sid, ch in _channels.items()
+                if not ch.connections and not ch.dirty and now - ch.last_active > ttl]:
+        del _channels[sid]
+
+def take_dirty() -> list:
+    """القنوات اللي جلساتها اتغيرت من آخر flush (وبيمسح العلامة)."""
+    with _lock:
+        out = [ch for ch in _channels.values() if ch.dirty]
+    for ch in out:
+        ch.dirty = False
+    return out
+
+def drop_sessions():
+    """memory.json اتمسح (reset): الجلسات المقيمة تتحمل من جديد في الدور الجاي."""
+    with _lock:
+        chans = list(_channels.values())
+    for ch in chans:
+        with ch.lock:
+            ch.session = None
+            ch.flushed = 0
+            ch.dirty = False
+
+def open_connection(session_id: str, deliver) -> Channel:
+    """سجّل اتصال جديد على قناة الجلسة (TooManyConnections لو وصلنا للحد)."""
+    global _connections
+    with _lock:
+        if _connections >= int(_settings.get("max_connections", DEFAULTS["max_connections"])):
+            raise TooManyConnections()
+        _connections += 1
+    ch = get_channel(session_id)
+    ch.attach(deliver)
+    ch.publish("ready", ch.state())
+    return ch
+
+def close_connection(ch: Channel, deliver):
+    global _connections
+    ch.detach(deliver)
+    with _lock:
+        _connections -= 1
+
+def heartbeat_interval() -> float:
+    return float(_settings.get("heartbeat", DEFAULTS["heartbeat"]))
+
+def queue_size() -> int:
+    return int(_settings.get("queue_size", DEFAULTS["queue_size"]))
+
+def flush_delay() -> float:
+    return float(_settings.get("flush_ms", DEFAULTS["flush_ms"])) / 1000.0
+
+def count_dropped():
+    global _dropped
+    _dropped += 1
+
+# ------------------------
+# Flask (thread لكل اتصال)
+# ------------------------
+class QueueSubscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=queue_size())
+
+    def __call__(self, msg: str):
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            count_dropped()  # العميل مش بيقرا: نرمي بدل ما نوقف اللي بيبعت
+
+def sse_stream(session_id: str):
+    """
+    (generator, close) لـ Flask Response: أحداث القناة + heartbeat لحد ما العميل يقفل.
+    close لازم يتسجل في response.call_on_close: لو العميل قفل قبل أول yield الـ finally مش هيشتغل.
+    """
+    sub = QueueSubscriber()
+    ch = open_connection(session_id, sub)
+    closed = []
+
+    def close():
+        if not closed:
+            closed.append(True)
+            close_connection(ch, sub)
+
+    def generate():
+        try:
+            yield PRELUDE
+            while True:
+                try:
+                    yield sub.queue.get(timeout=heartbeat_interval())
+                except queue.Empty:
+                    yield HEARTBEAT
+        finally:
+            close()
+    return generate(), close
+
+# ------------------------
+# إعدادات وعدادات
+# ------------------------
+def configure(cfg: dict):
+    """يُستدعى مع كل نسخة جديدة من config.json (watcher)."""
+    section = (cfg or {}).get("channels") or {}
+    if not isinstance(section, dict):
+        return
+    _settings.clear()
+    _settings.update(DEFAULTS)
+    _settings.update(section)
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "channels": len(_channels),
+            "connections": _connections,
+            "dropped_events": _dropped,
+            "max_connections": int(_settings.get("max_connections", DEFAULTS["max_connections"])),
+        }
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+compact.py — تمثيل مضغوط للـ corpus في الذاكرة (dataset والرسائل)
+- StringTable: كل نص بيتخزن مرة واحدة ويتشار له برقم (interning)؛ الإجابات المكررة زي "الحمد لله" نسخة واحدة.
+- PairTable / MessageTable: أعمدة أرقام في array (4 بايت للـ id) بدل tuple أو dict لكل صف.
+- PairView / MessageView: views بـ __slots__ بتتعمل وقت القراءة بس، ومش بتتخزن.
+- PairTable بتتصرف زي list of (question, answer): len, iteration, indexing و slicing،
+  فالكود اللي بيعمل `for q, a in dataset` بيفضل شغال زي ما هو.
+"""
+from array import array
+from collections import Counter
+
+ID_TYPE = "i"  # int32
+
+class StringTable:
+    """نص <-> id. بيكبر بس (الـ ids ثابتة طول عمر الجدول)."""
+    __slots__ = ("_ids", "_strings")
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+
+    def intern(self, s: str) -> int:
+        sid = self._ids.get(s)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(s)
+            self._ids[s] = sid
+        return sid
+
+    def id_of(self, s: str) -> int:
+        """id النص أو -1 لو مش موجود (من غير ما يضيفه)."""
+        return self._ids.get(s, -1)
+
+    def __getitem__(self, sid: int) -> str:
+        return self._strings[sid]
+
+    def __len__(self):
+        return len(self._strings)
+
+# ------------------------
+# Pairs (dataset)
+# ------------------------
+class PairView:
+    __slots__ = ("_table", "row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self.row = row
+
+    @property
+    def question(self) -> str:
+        t = self._table
+        return t.strings[t.q[self.row]]
+
+    @property
+    def answer(self) -> str:
+        t = self._table
+        return t.strings[t.a[self.row]]
+
+    def as_tuple(self):
+        return (self.question, self.answer)
+
+class PairTable:
+    """أزواج (question, answer) كعمودين ids + عداد للأزواج عشان فحص التكرار O(1)."""
+    __slots__ = ("strings", "q", "a", "_keys")
+
+    def __init__(self, strings: StringTable = None):
+        self.strings = strings if strings is not None else StringTable()
+        self.q = array(ID_TYPE)
+        self.a = array(ID_TYPE)
+        self._keys = {}  # (qid << 32) | aid -> عدد التكرار
+
+    @classmethod
+    def from_pairs(cls, pairs, strings: StringTable = None):
+        table = cls(strings)
+        for q, a in pairs:
+            table.append(q, a)
+        return table
+
+    def append(self, question: str, answer: str) -> int:
+        qid = self.strings.intern(question)
+        aid = self.strings.intern(answer)
+        # q آخر عمود: len(self.q) هو عدد الصفوف الكاملة، فالقراءة المتزامنة (iter / slicing) ماتشوفش صف نصه مكتوب
+        self.a.append(aid)
+        self.q.append(qid)
+        key = (qid << 32) | aid
+        self._keys[key] = self._keys.get(key, 0) + 1
+        return len(self.q) - 1
+
+    def _key(self, question: str, answer: str):
+        qid = self.strings.id_of(question)
+        aid = self.strings.id_of(answer)
+        if qid < 0 or aid < 0:
+            return None
+        return (qid << 32) | aid
+
+    def contains(self, question: str, answer: str) -> bool:
+        key = self._key(question, answer)
+        return key is not None and key in self._keys
+
+    def __contains__(self, pair):
+        return self.contains(pair[0], pair[1])
+
+    def filtered(self, keep):
+        """جدول جديد (بنفس جدول النصوص) فيه الصفوف اللي keep(question, answer) بترجع لها True."""
+        out = PairTable(self.strings)
+        s = self.strings
+        for qid, aid in zip(self.q, self.a):
+            if keep(s[qid], s[aid]):
+                out.q.append(qid)
+                out.a.append(aid)
+                key = (qid << 32) | aid
+                out._keys[key] = out._keys.get(key, 0) + 1
+        return out
+
+    def view(self, row: int) -> PairView:
+        return PairView(self, row)
+
+    def __len__(self):
+        return len(self.q)
+
+    def __iter__(self):
+        # الطول بيتاخد مرة واحدة: append من thread تاني مش بيأثر على iteration شغالة
+        s, q, a = self.strings, self.q, self.a
+        for i in range(len(q)):
+            yield s[q[i]], s[a[i]]
+
+    def __getitem__(self, idx):
+        s = self.strings
+        if isinstance(idx, slice):
+            return [(s[self.q[i]], s[self.a[i]]) for i in range(*idx.indices(len(self.q)))]
+        return s[self.q[idx]], s[self.a[idx]]
+
+# ------------------------
+# Messages (memory)
+# ------------------------
+class MessageView:
+    __slots__ = ("_table", "row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self.row = row
+
+    @property
+    def timestamp(self) -> int:
+        return self._table.ts[self.row]
+
+    @property
+    def user_text(self) -> str:
+        t = self._table
+        return t.strings[t.user[self.row]]
+
+    @property
+    def bot_text(self) -> str:
+        t = self._table
+        return t.strings[t.bot[self.row]]
+
+    def to_dict(self) -> dict:
+        return {"timestamp": self.timestamp, "user_text": self.user_text, "bot_text": self.bot_text}
+
+class MessageTable:
+    """
+    رسائل كل الجلسات كأعمدة (timestamp, user id, bot id)، وكل جلسة ليها array
+    بأرقام صفوفها بالترتيب (offset الرسالة في الجلسة = مكانها في الـ array دي).
+    """
+    __slots__ = ("strings", "ts", "user", "bot", "_sessions")
+
+    def __init__(self, strings: StringTable = None):
+        self.strings = strings if strings is not None else StringTable()
+        self.ts = array("q")
+        self.user = array(ID_TYPE)
+        self.bot = array(ID_TYPE)
+        self._sessions = {}  # session_id -> array of rows (بترتيب الإضافة)
+
+    def append(self, session_id: str, message: dict) -> int:
+        # ts آخر عمود: len(self.ts) هو عدد الصفوف الكاملة، فالقراءة المتزامنة (pairs) ماتشوفش صف نصه مكتوب
+        row = len(self.ts)
+        self.user.append(self.strings.intern(message.get("user_text") or ""))
+        self.bot.append(self.strings.intern(message.get("bot_text") or ""))
+        self.ts.append(int(message.get("timestamp") or 0))
+        rows = self._sessions.get(session_id)
+        if rows is None:
+            rows = self._sessions[session_id] = array(ID_TYPE)
+        rows.append(row)
+        return row
+
+    def add_session(self, session_id: str):
+        self._sessions.setdefault(session_id, array(ID_TYPE))
+
+    def session_rows(self, session_id: str):
+        return self._sessions.get(session_id) or array(ID_TYPE)
+
+    def session_ids(self):
+        return list(self._sessions)
+
+    @property
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    def view(self, row: int) -> MessageView:
+        return MessageView(self, row)
+
+    def pairs(self, session_id: str = None):
+        """(user_text, bot_text) لكل الرسائل أو لجلسة واحدة."""
+        s, user, bot = self.strings, self.user, self.bot
+        rows = self.session_rows(session_id) if session_id else range(len(self.ts))
+        for r in rows:
+            yield s[user[r]], s[bot[r]]
+
+    def user_text_counts(self) -> Counter:
+        """تكرار كل سؤال (بيعد الـ ids الأول وبعدين يحولها لنصوص)."""
+        counts = Counter(self.user)
+        s = self.strings
+        return Counter({s[uid]: n for uid, n in counts.items() if s[uid]})
+
+    def __len__(self):
+        return len(self.ts)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+corpus_store.py — مخزن واحد مشترك لأزواج dataset.csv بين app و ai_engine
+- الإضافة بتتكتب سطر في آخر الملف وتتضاف للجدول في الذاكرة بدون إعادة parse للملف كله.
+- الأزواج في PairTable (compact.py): نصوص interned وعمودين ids، وفحص التكرار O(1).
+- version بيزيد مع كل تغيير، وأي كاش أو index يقدر يشترك عن طريق subscribe().
+- التعديلات الخارجية على الملف بتوصل عن طريق watcher.py فيتعمل reload كامل.
+"""
+import csv
+import logging
+import threading
+
+from compact import PairTable
+from watcher import get_watcher, iter_csv_pairs, DS_PATH
+
+HEADER = ["question", "answer"]
+
+class CorpusStore:
+    def __init__(self, path, watcher=None, name="dataset"):
+        self.path = path
+        self.name = name
+        self.version = 0
+        self._watcher = watcher
+        self._pairs = PairTable()  # (question, answer) بنفس ترتيب الملف
+        self._lock = threading.RLock()
+        self._subscribers = []
+
+    # ------------------------
+    # قراءة
+    # ------------------------
+    @property
+    def pairs(self):
+        """الجدول الحالي (لا تعدله). بيتبدل بجدول جديد عند reload/remove فالـ iterators القديمة آمنة."""
+        return self._pairs
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def __iter__(self):
+        return iter(self._pairs)
+
+    def __contains__(self, pair):
+        return pair in self._pairs
+
+    def contains(self, question: str, answer: str) -> bool:
+        return self._pairs.contains(question, answer)
+
+    def subscribe(self, callback):
+        """callback(store) بعد أي تغيير (append / remove / reload)."""
+        self._subscribers.append(callback)
+
+    # ------------------------
+    # كتابة
+    # ------------------------
+    def load(self):
+        """parse كامل للملف — عند البدء أو لما الملف يتغير من برة العملية."""
+        with self._lock:
+            try:
+                pairs = PairTable.from_pairs(iter_csv_pairs(self.path) if self.path.exists() else ())
+            except Exception as e:
+                logging.warning(f"failed loading {self.path.name}: {e}")
+                return self
+            self._pairs = pairs
+            self._bump()
+        logging.info(f"dataset loaded: {len(pairs)} pairs (v{self.version})")
+        return self
+
+    def append(self, question: str, answer: str, dedupe: bool = False) -> bool:
+        """يضيف زوج في آخر الملف والذاكرة. dedupe=True يتجاهل الزوج لو موجود."""
+        with self._lock:
+            if dedupe and self._pairs.contains(question, answer):
+                return False
+            exists = self.path.exists()
+            broken_tail = exists and _missing_newline(self.path)
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                if broken_tail:
+                    # آخر سطر من غير newline (ملف متعدل يدوي) — وإلا الزوج هيلزق فيه
+                    f.write("\r\n")
+                writer = csv.writer(f)
+                if not exists:
+                    writer.writerow(HEADER)
+                writer.writerow([question, answer])
+            self._pairs.append(question, answer)
+            self._bump()
+        self._acknowledge()
+        return True
+
+    def remove(self, question: str, answer: str = None) -> int:
+        """يمسح كل الأزواج اللي سؤالها question (ولو answer محددة، لازم تطابق). يرجع العدد."""
+        with self._lock:
+            new_pairs = self._pairs.filtered(lambda q, a: not (q == question and (not answer or a == answer)))
+            removed = len(self._pairs) - len(new_pairs)
+            if removed:
+                self._rewrite(new_pairs)
+        if removed:
+            self._acknowledge()
+        return removed
+
+    def reset(self):
+        with self._lock:
+            self._rewrite(PairTable())
+        self._acknowledge()
+
+    def _rewrite(self, pairs):
+        with open(self.path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            for q, a in pairs:
+                writer.writerow([q, a])
+        self._pairs = pairs
+        self._bump()
+
+    def _acknowledge(self):
+        # الملف اتغير مننا: حدّث التوقيع في watcher بدون reload.
+        # برة self._lock: الـ watcher بينادي load() (اللي محتاج self._lock) وهو ماسك قفله
+        if self._watcher is not None:
+            self._watcher.acknowledge(self.name)
+
+    def _bump(self):
+        self.version += 1
+        for cb in list(self._subscribers):
+            try:
+                cb(self)
+            except Exception as e:
+                logging.warning(f"[CORPUS] subscriber failed: {e}")
+
+def _missing_newline(path) -> bool:
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, 2)
+        return f.read(1) not in (b"\n", b"\r")
+
+# ------------------------
+# المخزن المشترك
+# ------------------------
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> CorpusStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            w = get_watcher()
+            store = CorpusStore(DS_PATH, w, "dataset")
+            # أول استدعاء بيعمل load، وبعد كده مع كل تعديل خارجي على الملف
+            w.subscribe("dataset", lambda snap: store.load())
+            _store = store
+    return _store
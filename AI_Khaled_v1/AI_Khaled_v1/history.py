@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+history.py — فهرس لرسائل كل جلسة في memory.json عشان الواجهة تقرأ آخر المحادثة بس
+- الرسائل في MessageTable (compact.py): نصوص interned وأعمدة ids، وكل جلسة array بأرقام صفوفها.
+  الـ offset في الجلسة هو الـ cursor (before).
+- page() بتقرا آخر limit رسالة قبل before، فالتكلفة على قد الصفحة مش على قد الذاكرة كلها.
+- اللي بيكتب memory.json (app و ai_engine) بينادي update(mem) بعد الحفظ، فالفهرس بيضيف
+  الرسائل الجديدة بس ومايعيدش parse للملف.
+- retrieve و markov و /api/stats بيقروا من الجدول ده بدل قراءة memory.json مع كل طلب.
+- التعديلات الخارجية على الملف بتوصل عن طريق watcher.py فيتعمل reload كامل.
+"""
+import json
+import logging
+import threading
+
+from compact import MessageTable
+from watcher import get_watcher, MEM_PATH
+
+DEFAULT_LIMIT = 30
+MAX_LIMIT = 200
+
+class HistoryIndex:
+    def __init__(self, path, watcher=None, name="memory"):
+        self.path = path
+        self.name = name
+        self._watcher = watcher
+        self._table = MessageTable()
+        self._last = ""  # آخر جلسة في الملف
+        self._lock = threading.Lock()
+
+    def load(self):
+        """parse كامل للملف — عند البدء أو لما الملف يتغير من برة العملية."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                mem = json.load(f)
+        except FileNotFoundError:
+            mem = {"sessions": []}
+        except Exception as e:
+            logging.warning(f"failed loading {self.path.name}: {e}")
+            return self
+        self._index(mem, incremental=False)
+        return self
+
+    def update(self, mem: dict):
+        """اتنادى بعد ما العملية حفظت mem في الملف: حدّث الفهرس والتوقيع بدون reload."""
+        self._index(mem, incremental=True)
+        if self._watcher is not None:
+            self._watcher.acknowledge(self.name)
+
+    def _index(self, mem: dict, incremental: bool):
+        sessions = [(str(s.get("id", "")), s.get("messages") or [])
+                    for s in (mem or {}).get("sessions", []) if s.get("id")]
+        with self._lock:
+            table = self._table
+            if incremental:
+                # الكتّاب بيضيفوا رسائل في الآخر بس؛ لو جلسة اختفت أو قصرت (reset) نبني من الأول
+                seen = {sid: len(msgs) for sid, msgs in sessions}
+                incremental = all(seen.get(sid, -1) >= len(table.session_rows(sid))
+                                  for sid in table.session_ids())
+            if not incremental:
+                table = MessageTable()
+            for sid, msgs in sessions:
+                have = len(table.session_rows(sid))
+                table.add_session(sid)
+                for m in msgs[have:]:
+                    table.append(sid, m)
+            self._table = table
+            self._last = sessions[-1][0] if sessions else ""
+
+    @property
+    def table(self) -> MessageTable:
+        return self._table
+
+    @property
+    def last_session(self) -> str:
+        return self._last
+
+    def page(self, session_id: str, before: int = None, limit: int = DEFAULT_LIMIT) -> dict:
+        """
+        آخر limit رسالة قبل before (offset؛ None = آخر الجلسة)، من الأقدم للأحدث.
+        next_before هو الـ cursor للصفحة اللي قبلها (None لو وصلنا لأول الجلسة).
+        """
+        table = self._table
+        rows = table.session_rows(session_id)
+        total = len(rows)
+        end = total if before is None else max(0, min(before, total))
+        start = max(0, end - max(1, min(limit, MAX_LIMIT)))
+        items = [dict(table.view(rows[i]).to_dict(), index=i) for i in range(start, end)]
+        return {
+            "session_id": session_id,
+            "messages": items,
+            "total": total,
+            "next_before": start if start > 0 else None,
+        }
+
+# ------------------------
+# الفهرس المشترك
+# ------------------------
+_history = None
+_history_lock = threading.Lock()
+
+def get_history() -> HistoryIndex:
+    global _history
+    with _history_lock:
+        if _history is None:
+            w = get_watcher()
+            index = HistoryIndex(MEM_PATH, w, "memory")
+            # أول استدعاء بيعمل load، وبعد كده مع كل تعديل خارجي على الملف
+            w.subscribe("memory", lambda snap: index.load())
+            _history = index
+    return _history
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+loadtest.py — إعادة تشغيل ترافيك حقيقي (أو مزيج صناعي) على /api/chat
+- المصدر: جلسات data/memory.json أو مزيج صناعي من dataset.csv و kb.json وأسئلة مجهولة.
+- closed-loop: عدد ثابت من العملاء، كل عميل يبعت الطلب الجاي بعد ما الرد يوصل.
+- open-loop: الطلبات تتبعت بمعدل ثابت (req/s) بغض النظر عن سرعة السيرفر،
+  والـ latency بتتحسب من الموعد المفروض (بدون coordinated omission). عدد الـ threads على قد
+  rate × timeout عشان الـ executor مايبقاش هو الحد، والانتظار فيه بيتطبع لوحده (queue_wait_ms).
+- بيطبع throughput و p50/p95/p99 ونسبة الأخطاء وتوزيع الـ tiers من meta في الرد.
+- --spawn يشغل app.py محلياً على نسخة جديدة من مجلد data ومجلد model لكل تشغيلة
+  (نتايج قابلة للتكرار، وإعادة التدريب أثناء الاختبار مابتكتبش على النموذج الحقيقي).
+
+أمثلة:
+  python loadtest.py --spawn --mode closed --concurrency 8 --requests 500
+  python loadtest.py --url http://127.0.0.1:5000 --mode open --rate 50 --duration 30
+"""
+import os
+import sys
+import csv
+import math
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
+MODEL_DIR = Path(os.environ.get("AI_KHALED_MODEL_DIR") or ROOT / "model")
+
+# ------------------------
+# مصادر الترافيك
+# ------------------------
+def memory_traffic(data_dir: Path):
+    """[(session_id, text)] بنفس ترتيب الرسائل في memory.json."""
+    try:
+        mem = json.load(open(data_dir / "memory.json", "r", encoding="utf-8"))
+    except Exception as e:
+        print(f"⚠️ failed reading memory.json: {e}")
+        return []
+    out = []
+    for sess in mem.get("sessions", []):
+        sid = str(sess.get("id") or "")
+        for m in sess.get("messages", []):
+            text = (m.get("user_text") or "").strip()
+            if text:
+                out.append((sid, text))
+    return out
+
+def synthetic_traffic(data_dir: Path, n: int, rng: random.Random, unknown_ratio: float = 0.1):
+    """مزيج: أسئلة الداتاسيت ومفاتيح KB (مع تكرار زي الترافيك الحقيقي) + نسبة أسئلة مجهولة."""
+    known = []
+    try:
+        with open(data_dir / "dataset.csv", "r", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            known.extend(row[0].strip() for row in reader if row and row[0].strip())
+    except Exception:
+        pass
+    try:
+        known.extend(json.load(open(data_dir / "kb.json", "r", encoding="utf-8")).keys())
+    except Exception:
+        pass
+    if not known:
+        known = ["hello"]
+    out = []
+    for i in range(n):
+        sid = f"lt-{rng.randrange(max(1, n // 20))}"
+        if rng.random() < unknown_ratio:
+            text = "سؤال تجريبي " + " ".join(rng.choice("abcdefghij") * 3 for _ in range(3))
+        else:
+            # توزيع zipf تقريبي: الأسئلة الأولى أكثر تكراراً
+            idx = min(int(rng.paretovariate(1.2)) - 1, len(known) - 1)
+            text = known[idx]
+        out.append((sid, text))
+    return out
+
+# ------------------------
+# السيرفر المحلي (--spawn)
+# ------------------------
+def fresh_data_copy(src: Path, model_src: Path = MODEL_DIR) -> Path:
+    """نسخة من data (يرجع مسارها) و model جنبها في نفس المجلد المؤقت."""
+    dst = Path(tempfile.mkdtemp(prefix="ai_khaled_lt_")) / "data"
+    shutil.copytree(src, dst, ignore=shutil.ignore_patterns("backups", "profiles", "*.log", "logs.txt*"))
+    model_dst = dst.parent / "model"
+    if model_src.exists():
+        shutil.copytree(model_src, model_dst, ignore=shutil.ignore_patterns("*.tmp"))
+    else:
+        model_dst.mkdir()
+    return dst
+
+def spawn_server(port: int, data_dir: Path, timeout: float = 30.0):
+    env = dict(os.environ, AI_KHALED_DATA_DIR=str(data_dir), AI_KHALED_MODEL_DIR=str(data_dir.parent / "model"))
+    code = f"import app; app.start_server(port={port})"
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=str(ROOT), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            # /api/ready بيرجع 503 لحد ما الـ prewarm يخلص
+            urllib.request.urlopen(url + "/api/ready", timeout=1).read()
+            return proc, url
+        except Exception:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not become ready in time")
+
+# ------------------------
+# طلب واحد
+# ------------------------
+class Result:
+    __slots__ = ("latency", "status", "tier", "error", "queued")
+
+    def __init__(self, latency, status, tier=None, error=None, queued=None):
+        self.latency = latency
+        self.status = status
+        self.tier = tier
+        self.error = error
+        self.queued = queued  # open-loop: الوقت من الموعد المفروض لحد ما الطلب اتبعت فعلاً
+
+def send_chat(url: str, session_id: str, text: str, timeout: float, scheduled: float = None) -> Result:
+    body = json.dumps({"text": text, "session_id": session_id}, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url + "/api/chat", data=body, headers={"Content-Type": "application/json"})
+    sent = time.perf_counter()
+    start = scheduled if scheduled is not None else sent
+    queued = max(0.0, sent - scheduled) if scheduled is not None else None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = json.loads(resp.read().decode("utf-8") or "{}")
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        return Result(time.perf_counter() - start, e.code, error=f"http {e.code}", queued=queued)
+    except Exception as e:
+        return Result(time.perf_counter() - start, 0, error=type(e).__name__, queued=queued)
+    tier = (payload.get("meta") or {}).get("tier") or "unknown"
+    return Result(time.perf_counter() - start, status, tier=tier, queued=queued)
+
+# ------------------------
+# أوضاع التشغيل
+# ------------------------
+def run_closed(url, traffic, concurrency, total, duration, timeout):
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(total if total else 10 ** 12))
+    stop_at = time.perf_counter() + duration if duration else None
+
+    def worker():
+        while True:
+            if stop_at and time.perf_counter() >= stop_at:
+                return
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            sid, text = traffic[i % len(traffic)]
+            r = send_chat(url, sid, text, timeout)
+            with lock:
+                results.append(r)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - t0
+
+def open_workers(concurrency, rate, timeout):
+    """أقصى عدد طلبات ممكن تبقى شغالة في نفس الوقت: rate × timeout (و concurrency كحد أدنى)."""
+    return max(concurrency, math.ceil(rate * timeout) + 1)
+
+def run_open(url, traffic, concurrency, total, duration, rate, timeout, rng, poisson):
+    if not total:
+        total = int(rate * (duration or 10))
+    futures = []
+    late = 0
+    t0 = time.perf_counter()
+    next_at = t0
+    with ThreadPoolExecutor(max_workers=open_workers(concurrency, rate, timeout)) as pool:
+        for i in range(total):
+            next_at += rng.expovariate(rate) if poisson else 1.0 / rate
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.001:
+                late += 1
+            sid, text = traffic[i % len(traffic)]
+            futures.append(pool.submit(send_chat, url, sid, text, timeout, next_at))
+        results = [f.result() for f in futures]
+    return results, time.perf_counter() - t0, late
+
+# ------------------------
+# التقرير
+# ------------------------
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def summarize(results, elapsed, extra=None):
+    lat = sorted(r.latency * 1000 for r in results)
+    ok = [r for r in results if r.error is None]
+    errors = Counter(r.error for r in results if r.error is not None)
+    tiers = Counter(r.tier for r in ok)
+    waits = sorted(r.queued * 1000 for r in results if r.queued is not None)
+    report = {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 50), 2),
+            "p95": round(percentile(lat, 95), 2),
+            "p99": round(percentile(lat, 99), 2),
+            "max": round(lat[-1], 2) if lat else 0.0,
+        },
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": dict(errors),
+        "tiers": {t: {"count": c, "share": round(c / len(ok), 4)} for t, c in tiers.most_common()},
+    }
+    if waits:
+        report["queue_wait_ms"] = {
+            "p50": round(percentile(waits, 50), 2),
+            "p95": round(percentile(waits, 95), 2),
+            "max": round(waits[-1], 2),
+        }
+    if extra:
+        report.update(extra)
+    return report
+
+def print_report(rep):
+    lat = rep["latency_ms"]
+    print(f"📊 {rep['requests']} requests in {rep['elapsed_s']}s -> {rep['throughput_rps']} req/s")
+    print(f"   latency ms: p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}")
+    print(f"   error rate: {rep['error_rate'] * 100:.2f}% {rep['errors'] or ''}")
+    if rep.get("queue_wait_ms"):
+        wait = rep["queue_wait_ms"]
+        print(f"   executor wait ms: p50={wait['p50']} p95={wait['p95']} max={wait['max']}")
+    if rep.get("late_dispatches"):
+        print(f"   ⚠️ late dispatches (load generator fell behind): {rep['late_dispatches']}")
+    print("   tiers: " + ", ".join(f"{t}={v['count']} ({v['share'] * 100:.1f}%)" for t, v in rep["tiers"].items()))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay chat traffic against /api/chat")
+    ap.add_argument("--url", default="http://127.0.0.1:5000")
+    ap.add_argument("--spawn", action="store_true", help="start app.py locally on a fresh copy of the data dir")
+    ap.add_argument("--port", type=int, default=5077, help="port for --spawn")
+    ap.add_argument("--data-dir", default=str(DATA_DIR), help="data dir used as traffic source (and copied by --spawn)")
+    ap.add_argument("--model-dir", default=str(MODEL_DIR), help="model dir copied by --spawn")
+    ap.add_argument("--source", choices=["memory", "synthetic"], default="memory")
+    ap.add_argument("--unknown-ratio", type=float, default=0.1, help="synthetic: share of unknown questions")
+    ap.add_argument("--mode", choices=["closed", "open"], default="closed")
+    ap.add_argument("--concurrency", type=int, default=4,
+                    help="closed-loop clients; open-loop: minimum workers (pool is sized from rate x timeout)")
+    ap.add_argument("--rate", type=float, default=20.0, help="open-loop requests per second")
+    ap.add_argument("--poisson", action="store_true", help="open-loop: exponential inter-arrival times")
+    ap.add_argument("--requests", type=int, default=0, help="total requests (0 = use --duration)")
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--shuffle", action="store_true", help="shuffle replayed traffic (seeded)")
+    ap.add_argument("--json", dest="json_out", help="write the report as JSON to this file")
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    src = Path(args.data_dir)
+    n_synth = args.requests or max(100, int(args.rate * args.duration))
+    traffic = memory_traffic(src) if args.source == "memory" else synthetic_traffic(src, n_synth, rng, args.unknown_ratio)
+    if not traffic:
+        print("🚫 no traffic to replay")
+        return 1
+    if args.shuffle:
+        rng.shuffle(traffic)
+
+    proc = None
+    url = args.url.rstrip("/")
+    run_dir = None
+    if args.spawn:
+        run_dir = fresh_data_copy(src, Path(args.model_dir))
+        print(f"🚀 starting server on port {args.port} with data copy {run_dir}")
+        proc, url = spawn_server(args.port, run_dir)
+    try:
+        print(f"🔧 {args.mode}-loop: {len(traffic)} traffic messages, concurrency={args.concurrency}"
+              + (f", rate={args.rate}/s" if args.mode == "open" else ""))
+        duration = None if args.requests else args.duration
+        extra = {"mode": args.mode, "concurrency": args.concurrency, "source": args.source, "seed": args.seed}
+        if args.mode == "closed":
+            results, elapsed = run_closed(url, traffic, args.concurrency, args.requests, duration, args.timeout)
+        else:
+            results, elapsed, late = run_open(url, traffic, args.concurrency, args.requests, duration,
+                                              args.rate, args.timeout, rng, args.poisson)
+            extra.update({"rate": args.rate, "late_dispatches": late,
+                          "workers": open_workers(args.concurrency, args.rate, args.timeout)})
+        rep = summarize(results, elapsed, extra)
+        print_report(rep)
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps(rep, ensure_ascii=False, indent=2), encoding="utf-8")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if run_dir is not None:
+            shutil.rmtree(run_dir.parent, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+log_pipeline.py — لوجينج غير متزامن مع تدوير وضغط
+- الـ logger بيحط السجل في Queue فقط (QueueHandler)، والكتابة للقرص في thread خلفي (QueueListener).
+- تدوير الملف بالحجم أو بالوقت (أيهما أولاً) وضغط النسخ القديمة بـ gzip.
+- الملف بيتكتب JSON سطر لكل حدث (ts, level, logger, msg, event + حقول زي tier/score/latency_ms).
+- log_event() بيطبق نسبة عينة لكل category، فاللوج في المسار الساخن يكاد يكون مجاني تحت الضغط.
+
+الإعدادات من config.json تحت "logging":
+  {"level": "INFO", "sampling": {"chat": 0.1, "tier": 0.01, "default": 1.0},
+   "max_bytes": 5242880, "backup_count": 5, "rotate_seconds": 86400, "compress": true,
+   "queue_size": 10000}
+"""
+import os
+import gzip
+import json
+import time
+import queue
+import random
+import atexit
+import shutil
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+DEFAULTS = {
+    "level": "INFO",
+    "sampling": {"default": 1.0},
+    "max_bytes": 5 * 1024 * 1024,
+    "backup_count": 5,
+    "rotate_seconds": 24 * 3600,
+    "compress": True,
+    "queue_size": 10000,
+}
+
+_settings = dict(DEFAULTS)
+_sampling = dict(DEFAULTS["sampling"])
+_listeners = []  # QueueListener لكل ملف
+_lock = threading.Lock()
+
+# ------------------------
+# Formatter
+# ------------------------
+class JsonFormatter(logging.Formatter):
+    """سطر JSON لكل سجل. الحقول الإضافية بتيجي من extra={"event":..., "fields": {...}}."""
+
+    def format(self, record):
+        out = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            out["event"] = event
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        rate = getattr(record, "sample_rate", None)
+        if rate is not None and rate < 1.0:
+            out["sample_rate"] = rate
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    """نفس شكل اللوج القديم للكونسول، مع الحقول المهيكلة في آخر السطر."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+# ------------------------
+# Rotation (size + time) مع gzip
+# ------------------------
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes, backup_count, rotate_seconds=0, compress=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_seconds = rotate_seconds
+        self._next_rollover = self._compute_next()
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = _gzip_rotator
+
+    def _compute_next(self):
+        return time.time() + self.rotate_seconds if self.rotate_seconds else None
+
+    def set_rotate_seconds(self, seconds):
+        if seconds != self.rotate_seconds:
+            self.rotate_seconds = seconds
+            self._next_rollover = self._compute_next()
+
+    def shouldRollover(self, record):
+        if self._next_rollover is not None and time.time() >= self._next_rollover:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._next_rollover = self._compute_next()
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+# ------------------------
+# Queue handler (لا يحجب أبداً)
+# ------------------------
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """لو الطابور مليان (القرص بطيء) نرمي السجل ونعدّه بدل ما نوقف الطلب."""
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+# ------------------------
+# Setup
+# ------------------------
+def setup_logging(path, name=None, fmt="[%(asctime)s] [%(levelname)s] %(message)s", console=True):
+    """
+    يركب QueueHandler على logger (الـ root لو name=None) ويشغل writer thread
+    بيكتب JSON في path (مع تدوير وضغط) ونص عادي على الكونسول.
+    """
+    logger = logging.getLogger(name)
+    with _lock:
+        for h in list(logger.handlers):
+            if isinstance(h, DroppingQueueHandler):
+                return logger  # متركب بالفعل
+        q = queue.Queue(maxsize=int(_settings.get("queue_size", 10000)))
+        file_handler = CompressingRotatingFileHandler(
+            path,
+            max_bytes=int(_settings.get("max_bytes", 0)),
+            backup_count=int(_settings.get("backup_count", 5)),
+            rotate_seconds=float(_settings.get("rotate_seconds", 0)),
+            compress=bool(_settings.get("compress", True)),
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers = [file_handler]
+        if console:
+            stream = logging.StreamHandler()
+            stream.setFormatter(ConsoleFormatter(fmt))
+            handlers.append(stream)
+        listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+        logger.addHandler(DroppingQueueHandler(q))
+        logger.setLevel(_level())
+        if name is not None:
+            logger.propagate = False
+    return logger
+
+def configure(cfg: dict):
+    """يتنادى مع كل نسخة جديدة من config.json: المستوى والـ sampling بيتغيروا فوراً."""
+    section = (cfg or {}).get("logging") or {}
+    if not isinstance(section, dict):
+        return
+    with _lock:
+        _settings.clear()
+        _settings.update(DEFAULTS)
+        _settings.update(section)
+        _sampling.clear()
+        _sampling.update(DEFAULTS["sampling"])
+        _sampling.update(section.get("sampling") or {})
+    level = _level()
+    for listener in _listeners:
+        for h in listener.handlers:
+            if isinstance(h, CompressingRotatingFileHandler):
+                h.maxBytes = int(_settings.get("max_bytes", 0))
+                h.backupCount = int(_settings.get("backup_count", 5))
+                h.set_rotate_seconds(float(_settings.get("rotate_seconds", 0)))
+    for lg in [logging.getLogger()] + [logging.getLogger(n) for n in list(logging.root.manager.loggerDict)]:
+        if any(isinstance(h, DroppingQueueHandler) for h in lg.handlers):
+            lg.setLevel(level)
+
+def _level():
+    lvl = _settings.get("level", "INFO")
+    return lvl if isinstance(lvl, int) else logging.getLevelName(str(lvl).upper())
+
+def stats() -> dict:
+    return {
+        "dropped": DroppingQueueHandler.dropped,
+        "queued": sum(l.queue.qsize() for l in _listeners),
+        "sampling": dict(_sampling),
+    }
+
+@atexit.register
+def shutdown():
+    # فرّغ الطابور قبل الخروج
+    while _listeners:
+        try:
+            _listeners.pop().stop()
+        except Exception:
+            pass
+
+# ------------------------
+# Structured events with sampling
+# ------------------------
+def log_event(logger, category: str, msg: str, level=logging.INFO, **fields):
+    """
+    حدث مهيكل بنسبة عينة حسب category (sampling في config).
+    التحقق من النسبة قبل أي تنسيق، فالتكلفة لما الحدث يترمي رقم عشوائي واحد.
+    """
+    rate = _sampling.get(category, _sampling.get("default", 1.0))
+    if rate <= 0 or (rate < 1.0 and random.random() >= rate):
+        return
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, msg, extra={"event": category, "fields": fields, "sample_rate": rate})
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+model_store.py — تحديث نموذج الـ ML في الذاكرة مع كل زوج جديد (بدون إعادة تدريب كاملة)
+- ResidentModel: (vec, KNN, info) اللي اتحمل من khalid_model.pkl + الصفوف اللي اتضافت بعده.
+  info (من train.py) فيها y (labels التدريب بترتيب الصفوف) وعدد صفوف dataset.csv اللي اتدربت (dataset_rows).
+  ملف بالشكل القديم (vec, KNN) مابيتحدثش incremental: أول إضافة بتطلب إعادة تدريب كاملة.
+  الإضافة بتعمل vectorize للأسئلة الجديدة بنفس الـ vocabulary (أو مساحة الـ hashing) وتحطها في مصفوفة
+  جانبية صغيرة (الـ KNN المتدرب مابيتلمسش)، وبعدين swap — القراءات الشغالة بتكمل على النسخة القديمة.
+  predict بيدمج أقرب جيران النموذج مع أقرب صفوف المصفوفة الجانبية (weights="distance").
+- ModelStore مشترك في corpus_store: أي append في dataset.csv (تعليم، auto-learn، dataset/add)
+  بيتحط في buffer ويتطبق في BackgroundWorker (admission.defer) بعد الرد بأجزاء من الثانية.
+- إعادة التدريب الكاملة (train.py) بتتطلب مرة واحدة بس لما:
+  عدد الصفوف المضافة يعدي max_appended أو max_appended_ratio من حجم التدريب،
+  أو نسبة الكلمات/الـ features اللي النموذج ماشافهاش (drift) تعدي drift.
+- لما النموذج الجديد يتكتب، watcher بيحمله و reset() بيبدأ العد من الأول، وبيعيد تطبيق
+  الصفوف اللي بعد dataset_rows (اتعلمت وتدريب train.py شغال فماتبقاش في الملف).
+
+الإعدادات من config.json تحت "ml_incremental":
+  {"enabled": true, "max_appended": 1000, "max_appended_ratio": 0.2, "drift": 0.3, "min_terms": 20}
+"""
+import logging
+import threading
+
+import admission
+
+DEFAULTS = {
+    "enabled": True,
+    "max_appended": 1000,      # أقصى صفوف مضافة قبل إعادة تدريب كاملة
+    "max_appended_ratio": 0.2, # أو كنسبة من صفوف التدريب الأصلي
+    "drift": 0.3,              # نسبة الكلمات الجديدة (خارج الـ vocabulary) في الأسئلة المضافة
+    "min_terms": 20,           # مايتحسبش drift قبل العدد ده من الكلمات
+}
+
+N_NEIGHBORS = 3  # نفس train.py
+
+def _unseen_terms(vec, texts):
+    """(unknown, total): عدد الكلمات/الـ n-grams في texts اللي النموذج ماشافهاش وقت التدريب."""
+    vocab = getattr(vec, "vocabulary_", None)
+    if vocab is not None:
+        analyze = vec.build_analyzer()
+        unknown = total = 0
+        for t in texts:
+            for term in analyze(t):
+                total += 1
+                if term not in vocab:
+                    unknown += 1
+        return unknown, total
+    idf = getattr(vec, "idf_", None)
+    if idf is not None and hasattr(vec, "_get_hasher"):
+        # HashingTfidf: feature بـ df=0 وقت التدريب واخد أعلى idf
+        X = vec._get_hasher().transform(texts)
+        top = idf.max()
+        return int((idf[X.indices] >= top - 1e-6).sum()), int(X.nnz)
+    return 0, 0
+
+class ResidentModel:
+    """
+    النموذج المتدرب (من غير ما يتلمس) + مصفوفة جانبية صغيرة بالصفوف اللي اتضافت بعده.
+    predict بيجيب أقرب الجيران من الاتنين ويدمجهم، فالإضافة على قد الصفوف الجديدة بس
+    مش على قد مصفوفة التدريب كلها.
+    """
+    __slots__ = ("vec", "model", "y", "side_X", "side_y", "base_rows", "trained_rows", "appended", "unknown",
+                 "terms", "refit_requested")
+
+    def __init__(self, vec, model, y=None, side_X=None, side_y=(), base_rows=0, trained_rows=None, appended=0,
+                 unknown=0, terms=0, refit_requested=False):
+        self.vec = vec
+        self.model = model
+        self.y = y  # labels التدريب بترتيب الصفوف (None في الملفات القديمة)
+        self.side_X = side_X
+        self.side_y = list(side_y)
+        self.base_rows = base_rows
+        self.trained_rows = trained_rows  # صفوف dataset.csv اللي في التدريب (None = مش معروف)
+        self.appended = appended
+        self.unknown = unknown
+        self.terms = terms
+        self.refit_requested = refit_requested
+
+    @classmethod
+    def from_file(cls, loaded):
+        """من محتوى khalid_model.pkl: (vec, model, info) أو الشكل القديم (vec, model)."""
+        vec, model = loaded[0], loaded[1]
+        info = loaded[2] if len(loaded) > 2 and isinstance(loaded[2], dict) else {}
+        y = info.get("y")
+        base_rows = len(y) if y is not None else getattr(model, "n_samples_fit_", 0)
+        return cls(vec, model, y, base_rows=base_rows, trained_rows=info.get("dataset_rows"))
+
+    def predict(self, text: str):
+        x = self.vec.transform([text])
+        if self.side_X is None:
+            pred = self.model.predict(x)
+            return pred[0] if len(pred) else None
+        return self._merged_predict(x)
+
+    def _merged_predict(self, x):
+        import numpy as np
+        from sklearn.metrics import pairwise_distances
+        m = self.model
+        dist, idx = m.kneighbors(x, n_neighbors=min(N_NEIGHBORS, m.n_samples_fit_))
+        candidates = [(d, self.y[i]) for d, i in zip(dist[0], idx[0])]
+        side = pairwise_distances(x, self.side_X, metric=m.effective_metric_,
+                                  **(m.effective_metric_params_ or {}))[0]
+        candidates += [(side[j], self.side_y[j]) for j in np.argsort(side)[:N_NEIGHBORS]]
+        candidates = sorted(candidates, key=lambda c: c[0])[:N_NEIGHBORS]
+        # weights="distance" زي KNeighborsClassifier: التطابق التام (مسافة 0) بيكسب لوحده
+        exact = [label for d, label in candidates if d == 0]
+        votes = {}
+        for d, label in candidates:
+            if exact and d != 0:
+                continue
+            votes[label] = votes.get(label, 0.0) + (1.0 if exact else 1.0 / d)
+        return max(votes, key=votes.get) if votes else None
+
+    def with_rows(self, pairs):
+        """نسخة جديدة فيها pairs في المصفوفة الجانبية (الأصل والنموذج المتدرب مابيتغيروش)."""
+        import scipy.sparse as sp
+        if self.y is None:
+            raise ValueError("model file has no training labels (old format)")
+        questions = [q for q, _ in pairs]
+        new = self.vec.transform(questions)
+        side_X = new.tocsr() if self.side_X is None else sp.vstack([self.side_X, new], format="csr")
+        unknown, terms = _unseen_terms(self.vec, questions)
+        return ResidentModel(self.vec, self.model, self.y, side_X, self.side_y + [a for _, a in pairs],
+                             self.base_rows, self.trained_rows, self.appended + len(pairs),
+                             self.unknown + unknown, self.terms + terms, self.refit_requested)
+
+    def refit_reason(self, settings: dict):
+        if self.appended >= settings["max_appended"]:
+            return f"{self.appended} rows appended"
+        if self.base_rows and self.appended / self.base_rows >= settings["max_appended_ratio"]:
+            return f"{self.appended} rows appended ({self.appended / self.base_rows:.0%} of training set)"
+        if self.terms >= settings["min_terms"] and self.unknown / self.terms >= settings["drift"]:
+            return f"vocabulary drift {self.unknown / self.terms:.0%}"
+        return None
+
+    def status(self) -> dict:
+        return {
+            "incremental": self.y is not None,
+            "base_rows": self.base_rows,
+            "appended": self.appended,
+            "side_rows": len(self.side_y),
+            "drift": round(self.unknown / self.terms, 4) if self.terms else 0.0,
+            "refit_requested": self.refit_requested,
+        }
+
+class ModelStore:
+    def __init__(self, store, request_refit, settings=None):
+        """
+        store: CorpusStore (بيتسمع لـ append)، request_refit: callable يطلب train.py كامل،
+        settings: callable يرجع قسم "ml_incremental" من config.
+        """
+        self.current = None
+        self._request_refit = request_refit
+        self._settings = settings or (lambda: {})
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._store = store
+        self._table = store.pairs
+        self._seen = len(store)
+        store.subscribe(self._on_store)
+
+    def settings(self) -> dict:
+        out = dict(DEFAULTS)
+        section = self._settings()
+        if isinstance(section, dict):
+            out.update(section)
+        elif section is not None:
+            out["enabled"] = bool(section)  # "ml_incremental": false
+        return out
+
+    def reset(self, loaded):
+        """
+        نموذج جديد اتحمل من الملف (watcher): ابدأ من الأول، والصفوف اللي بعد trained_rows
+        (اتضافت وتدريب train.py شغال) تتطبق عليه من جديد.
+        """
+        current = ResidentModel.from_file(loaded) if loaded else None
+        with self._lock:
+            self.current = current
+            table = self._store.pairs
+            self._table = table
+            self._seen = len(table)
+            trained = current.trained_rows if current is not None else None
+            self._buffer = list(table[trained:self._seen]) if trained is not None and trained < self._seen else []
+            replay = len(self._buffer)
+        if replay and self.settings().get("enabled", True):
+            logging.info(f"[ML] re-applying {replay} rows added during training")
+            admission.defer("ml_update", self.apply_pending, key="ml_update")
+
+    def predict(self, text: str):
+        current = self.current
+        return current.predict(text) if current is not None else None
+
+    def status(self) -> dict:
+        current = self.current
+        out = current.status() if current is not None else {"loaded": False}
+        out["pending"] = len(self._buffer)
+        return out
+
+    # ------------------------
+    # تحديث
+    # ------------------------
+    def _on_store(self, store):
+        # بيتنادى من جوه قفل المخزن: خد الصفوف الجديدة بس وسيب الشغل التقيل للخلفية
+        enabled = self.settings().get("enabled", True)
+        with self._lock:
+            table = store.pairs
+            if table is not self._table:
+                # reload / remove / reset: الجدول اتبدل، مفيش صفوف "مضافة" نقدر نطبقها
+                self._table = table
+                self._seen = len(table)
+                return
+            n = len(table)
+            if n <= self._seen:
+                return
+            rows = table[self._seen:n]
+            self._seen = n
+            if not enabled:
+                return
+            self._buffer.extend(rows)
+        admission.defer("ml_update", self.apply_pending, key="ml_update")
+
+    def apply_pending(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            base = self.current
+        if not rows or base is None:
+            return
+        try:
+            updated = base.with_rows(rows)
+        except Exception as e:
+            logging.warning(f"[ML] incremental update failed, requesting full retrain: {e}")
+            self._request_refit()
+            return
+        with self._lock:
+            if self.current is not base:
+                return  # نموذج جديد اتحمل في النص: هو أحدث
+            self.current = updated
+        logging.info(f"[ML] appended {len(rows)} rows to resident model ({updated.appended} since last training)")
+        reason = updated.refit_reason(self.settings())
+        if reason and not updated.refit_requested:
+            updated.refit_requested = True
+            logging.info(f"[ML] scheduling full retrain: {reason}")
+            self._request_refit()
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+profiling.py — أدوات profiling عند الطلب لمسار الشات
+- cProfile لكل طلب لنسبة عينة من الطلبات (sample_rate).
+- sampling profiler خفيف في thread منفصل بيكتب collapsed stacks (.folded)
+  تنفع مع flamegraph.pl / speedscope.
+- لقطات tracemalloc لمتابعة نمو الذاكرة (_reply_cache و _pending).
+التفعيل من config.json تحت مفتاح "profiling" أو بإشارة SIGUSR2 (تبديل تشغيل/إيقاف).
+الملفات بتتحفظ في data/profiles وتقدر تنزلها من /api/admin/profiles.
+"""
+import io
+import os
+import sys
+import time
+import random
+import signal
+import logging
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
+PROFILE_DIR = DATA_DIR / "profiles"
+
+DEFAULTS = {
+    "enabled": False,
+    "sample_rate": 0.05,       # نسبة الطلبات اللي تتعمل لها cProfile
+    "sampler": False,          # تشغيل الـ sampling profiler
+    "sampler_interval": 0.005, # ثواني بين كل عينة
+    "sampler_flush": 30,       # ثواني بين كل كتابة لملف .folded
+    "tracemalloc": False,
+    "tracemalloc_frames": 10,
+    "max_files": 200,          # أقصى عدد ملفات نحتفظ بيه في PROFILE_DIR
+}
+
+_settings = dict(DEFAULTS)
+_signal_override = None  # None = اتبع config، True/False = مفروض من الإشارة
+_lock = threading.Lock()
+_sampler = None
+_local = threading.local()  # منع cProfile متداخل في نفس الـ thread
+_profile_lock = threading.Lock()  # طلب واحد عليه cProfile في نفس الوقت
+PROCESS_WIDE = sys.version_info >= (3, 12)  # cProfile مبني على sys.monitoring (كل الـ threads)
+_tracked = {}  # name -> callable يرجع الكائن المطلوب قياس حجمه (للتقارير)
+
+# ------------------------
+# إعدادات
+# ------------------------
+def configure(cfg: dict):
+    """يُستدعى مع كل نسخة جديدة من config.json (watcher)."""
+    section = (cfg or {}).get("profiling") or {}
+    with _lock:
+        _settings.clear()
+        _settings.update(DEFAULTS)
+        if isinstance(section, dict):
+            _settings.update(section)
+        elif section is True:
+            _settings["enabled"] = True
+    _apply()
+
+def enabled() -> bool:
+    if _signal_override is not None:
+        return _signal_override
+    return bool(_settings.get("enabled"))
+
+def status() -> dict:
+    return {
+        "enabled": enabled(),
+        "signal_override": _signal_override,
+        "settings": dict(_settings),
+        "sampler_running": bool(_sampler and _sampler.is_alive()),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+def set_override(value):
+    """True/False لفرض التشغيل، None للرجوع لإعدادات config."""
+    global _signal_override
+    _signal_override = value
+    _apply()
+
+def _apply():
+    on = enabled()
+    if on and _settings.get("sampler"):
+        _start_sampler()
+    else:
+        _stop_sampler()
+    if on and _settings.get("tracemalloc"):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(int(_settings.get("tracemalloc_frames", 10)))
+            logging.info("[PROFILE] tracemalloc started")
+    elif tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logging.info("[PROFILE] tracemalloc stopped")
+
+def _on_signal(signum, frame):
+    set_override(not enabled())
+    logging.info(f"[PROFILE] toggled by signal -> {enabled()}")
+
+def install_signal_handler():
+    """SIGUSR2 يبدّل الـ profiling. مش متاح على ويندوز، ولازم يتنادى من الـ main thread."""
+    sig = getattr(signal, "SIGUSR2", None)
+    if sig is None:
+        return False
+    try:
+        signal.signal(sig, _on_signal)
+        return True
+    except ValueError:
+        return False
+
+def track(name: str, getter):
+    """سجل كائن (dict مثلاً) عشان حجمه يظهر في تقارير tracemalloc."""
+    _tracked[name] = getter
+
+# ------------------------
+# ملفات الـ profiles
+# ------------------------
+def _new_path(kind: str, ext: str) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{kind}_{time.strftime('%Y%m%d_%H%M%S')}_{int(time.time() * 1000) % 1000:03d}_{os.getpid()}{ext}"
+    _prune()
+    return PROFILE_DIR / name
+
+def _prune():
+    files = sorted(PROFILE_DIR.glob("*"), key=lambda p: p.stat().st_mtime)
+    extra = len(files) - int(_settings.get("max_files", 200)) + 1
+    for p in files[:max(0, extra)]:
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+def list_profiles():
+    if not PROFILE_DIR.exists():
+        return []
+    out = []
+    for p in sorted(PROFILE_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True):
+        if p.is_file():
+            st = p.stat()
+            out.append({"name": p.name, "size": st.st_size, "mtime": int(st.st_mtime)})
+    return out
+
+def profile_path(name: str):
+    """يرجع المسار لو الاسم ملف داخل PROFILE_DIR فقط (بدون ../)."""
+    p = (PROFILE_DIR / name).resolve()
+    if p.parent != PROFILE_DIR.resolve() or not p.is_file():
+        return None
+    return p
+
+# ------------------------
+# cProfile لكل طلب (بعينة)
+# ------------------------
+@contextmanager
+def profile_request(label: str):
+    """
+    لف حوالين أي مسار ساخن. لو الـ profiling مقفول التكلفة مقارنة واحدة.
+    القرعة (sample_rate) بتحصل في أبعد استدعاء بس: المتداخل (generate_reply جوه chat) بيتبع قراره.
+    طلب واحد بس عليه cProfile في نفس الوقت (_profile_lock): من 3.12 الـ profiler على العملية كلها
+    و enable() التاني بيرمي ValueError، فالطلب اللي ييجي والتاني شغال بيكمل من غير profile.
+    """
+    if not enabled() or getattr(_local, "active", False):
+        yield None
+        return
+    prof = None
+    if random.random() < float(_settings.get("sample_rate", 0)) and _profile_lock.acquire(blocking=False):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # أداة profiling تانية شغالة في العملية (3.12+)
+            _profile_lock.release()
+            prof = None
+    start = time.perf_counter()
+    _local.active = True
+    # profiles من threads تانية (traced) بتتدمج في نفس الملف — قبل 3.12 بس
+    _local.extra = extra = [] if prof is not None and not PROCESS_WIDE else None
+    try:
+        yield prof
+    finally:
+        _local.active = False
+        _local.extra = None
+        if prof is not None:
+            prof.disable()
+            _profile_lock.release()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            try:
+                path = _new_path(f"req_{label}", ".prof")
+                stats = pstats.Stats(prof)
+                for p in list(extra or ()):
+                    stats.add(p)
+                stats.dump_stats(str(path))
+                logging.info(f"[PROFILE] {label} {elapsed_ms:.1f}ms -> {path.name}")
+            except Exception as e:
+                logging.warning(f"[PROFILE] failed to save profile: {e}")
+
+def traced(fn):
+    """
+    لف fn قبل ما تتبعت لـ thread pool: لو الطلب الحالي عليه cProfile، fn بتتعمل لها profile
+    في الـ worker وتتدمج في ملف الطلب. شغل بيخلص بعد الرد (طبقة اتخطت وكملت) مش بيظهر.
+    من 3.12 profile الطلب نفسه بيشوف كل الـ threads، فـ fn بترجع زي ما هي.
+    """
+    extra = getattr(_local, "extra", None)
+    if extra is None:
+        return fn
+
+    def run(*args, **kwargs):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+            extra.append(prof)
+    return run
+
+def profile_summary(name: str, limit: int = 30) -> str:
+    """نص pstats مختصر لملف .prof (أسهل من التنزيل للفحص السريع)."""
+    p = profile_path(name)
+    if p is None or p.suffix != ".prof":
+        return ""
+    buf = io.StringIO()
+    pstats.Stats(str(p), stream=buf).sort_stats("cumulative").print_stats(limit)
+    return buf.getvalue()
+
+# ------------------------
+# Sampling profiler (collapsed stacks)
+# ------------------------
+class StackSampler(threading.Thread):
+    def __init__(self, interval: float, flush_every: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.flush_every = flush_every
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_evt = threading.Event()
+
+    def stop(self):
+        self._stop_evt.set()
+
+    def run(self):
+        own = threading.get_ident()
+        last_flush = time.monotonic()
+        while not self._stop_evt.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+            if time.monotonic() - last_flush >= self.flush_every:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        if not self.stacks:
+            return None
+        stacks, self.stacks = self.stacks, Counter()
+        try:
+            path = _new_path("stacks", ".folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logging.info(f"[PROFILE] wrote {len(stacks)} stacks -> {path.name}")
+            return path
+        except Exception as e:
+            logging.warning(f"[PROFILE] failed to write stacks: {e}")
+            return None
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    # الترتيب من الجذر للورقة مع استبدال ';' لأنها فاصل التنسيق
+    return ";".join(p.replace(";", ":") for p in reversed(parts))
+
+def _start_sampler():
+    global _sampler
+    with _lock:
+        if _sampler and _sampler.is_alive():
+            return
+        _sampler = StackSampler(float(_settings.get("sampler_interval", 0.005)),
+                                float(_settings.get("sampler_flush", 30)))
+        _sampler.start()
+    logging.info("[PROFILE] sampler started")
+
+def _stop_sampler():
+    global _sampler
+    with _lock:
+        s, _sampler = _sampler, None
+    if s and s.is_alive():
+        s.stop()
+        logging.info("[PROFILE] sampler stopped")
+
+def flush_sampler():
+    s = _sampler
+    return s.flush() if s else None
+
+# ------------------------
+# tracemalloc
+# ------------------------
+_last_snapshot = None
+
+def memory_snapshot(limit: int = 25):
+    """يحفظ لقطة tracemalloc ويرجع أكبر فروقات عن اللقطة السابقة + أحجام الكائنات المتتبعة."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return None
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    if _last_snapshot is not None:
+        stats = snap.compare_to(_last_snapshot, "lineno")
+    else:
+        stats = snap.statistics("lineno")
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"# traced current={current} peak={peak}"]
+    for name, getter in _tracked.items():
+        try:
+            obj = getter()
+            lines.append(f"# {name}: entries={len(obj)} size={_deep_size(obj)}")
+        except Exception as e:
+            lines.append(f"# {name}: error {e}")
+    lines.extend(str(s) for s in stats[:limit])
+    _last_snapshot = snap
+    path = _new_path("tracemalloc", ".txt")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    logging.info(f"[PROFILE] tracemalloc snapshot -> {path.name}")
+    return path
+
+def _deep_size(obj, _depth=0) -> int:
+    size = sys.getsizeof(obj)
+    if _depth > 3:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _deep_size(k, _depth + 1) + _deep_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set)):
+        for v in obj:
+            size += _deep_size(v, _depth + 1)
+    return size
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+text_features.py — تمثيل TF-IDF بمساحة hashing ثابتة العرض
+- HashingTfidf: بديل لـ TfidfVectorizer بدون vocabulary، فالذاكرة ثابتة مهما كبرت الكلمات/الـ n-grams.
+- الـ IDF بيتحسب بتمريرة streaming أولى (partial_fit_df على chunks) ثم finalize_idf().
+- دوال الـ chunks على مستوى الموديول عشان تشتغل في ProcessPoolExecutor (train.py --streaming).
+الكائن بيتعمل له pickle مع النموذج، فلازم يفضل في موديول عادي (مش سكربت).
+يتطلب scikit-learn و numpy.
+"""
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+N_FEATURES = 2 ** 20
+NGRAM_RANGE = (1, 3)
+
+def make_hasher(n_features: int = N_FEATURES, ngram_range=NGRAM_RANGE) -> HashingVectorizer:
+    # counts خام (بدون norm وبدون إشارة متبادلة) عشان نطبق IDF بنفسنا
+    return HashingVectorizer(analyzer="word", ngram_range=tuple(ngram_range), n_features=n_features,
+                             alternate_sign=False, norm=None)
+
+class HashingTfidf:
+    """نفس صيغة TfidfVectorizer (smooth_idf, l2) لكن على مساحة hashing بعرض ثابت."""
+
+    def __init__(self, n_features: int = N_FEATURES, ngram_range=NGRAM_RANGE):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.df_ = np.zeros(n_features, dtype=np.int64)
+        self.n_docs_ = 0
+        self.idf_ = None
+        self._hasher = None
+
+    def _get_hasher(self):
+        if self._hasher is None:
+            self._hasher = make_hasher(self.n_features, self.ngram_range)
+        return self._hasher
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_hasher"] = None
+        state["df_"] = None  # مش محتاجينها بعد finalize_idf
+        return state
+
+    # ------------------------
+    # IDF (streaming)
+    # ------------------------
+    def partial_fit_df(self, texts):
+        add_df(self.df_, chunk_df(list(texts), self.n_features, self.ngram_range))
+        self.n_docs_ += len(texts)
+        return self
+
+    def add_chunk_df(self, chunk_result, n_docs: int):
+        add_df(self.df_, chunk_result)
+        self.n_docs_ += n_docs
+
+    def finalize_idf(self):
+        n = self.n_docs_
+        self.idf_ = (np.log((1.0 + n) / (1.0 + self.df_)) + 1.0).astype(np.float32)
+        return self
+
+    # ------------------------
+    # transform
+    # ------------------------
+    def transform(self, texts):
+        return apply_idf(self._get_hasher().transform(texts), self.idf_)
+
+    def fit_transform(self, texts):
+        texts = list(texts)
+        return self.partial_fit_df(texts).finalize_idf().transform(texts)
+
+def apply_idf(X, idf):
+    X = X.tocsr()
+    if idf is not None:
+        X.data = X.data * idf[X.indices]
+    return normalize(X, norm="l2", copy=False)
+
+def add_df(df, chunk_result):
+    idx, counts = chunk_result
+    np.add.at(df, idx, counts)
+
+# ------------------------
+# دوال الـ workers (ProcessPoolExecutor)
+# ------------------------
+def chunk_df(texts, n_features: int = N_FEATURES, ngram_range=NGRAM_RANGE):
+    """(indices, counts): عدد المستندات اللي فيها كل feature في الـ chunk (sparse عشان النقل رخيص)."""
+    X = make_hasher(n_features, ngram_range).transform(texts).tocsr()
+    X.sum_duplicates()
+    return np.unique(X.indices, return_counts=True)
+
+_worker_state = {}
+
+def init_worker(n_features: int, ngram_range, idf):
+    # بيتنادى مرة في كل process عشان الـ idf (4MB) مايتبعتش مع كل chunk
+    _worker_state["hasher"] = make_hasher(n_features, ngram_range)
+    _worker_state["idf"] = idf
+
+def chunk_transform(texts):
+    return apply_idf(_worker_state["hasher"].transform(texts), _worker_state["idf"])
@@ -5,23 +5,34 @@ train.py — تدريب نموذج الذكاء الصناعي
 ويحفظ النموذج في model/khalid_model.pkl
 يتعرف تلقائيًا على أسماء الأعمدة (question/answer أو user_text/bot_text)
 يتطلب scikit-learn
+
+وضع --streaming (out-of-core):
+- المصادر بتتقري كـ generators على chunks بدل ما تتحمل في list واحدة.
+- HashingTfidf بعرض ثابت (text_features.py) بدل vocabulary الـ trigrams، فالذاكرة ثابتة مهما كبر الـ vocabulary.
+- تمريرة أولى تحسب IDF، وتمريرة تانية تعمل vectorize على chunks بالتوازي على كل الأنوية.
+- يطبع peak RSS ووقت التنفيذ.
+  python train.py --streaming [--workers 4] [--chunk-size 5000] [--n-features 1048576]
 """
-import os, json, pickle, csv
+import os, sys, json, pickle, csv, time, argparse
+from functools import partial
 from pathlib import Path
 
 ROOT = Path(__file__).parent
-DATA_DIR = ROOT / "data"
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
 DS_PATH = DATA_DIR / "dataset.csv"
 MEM_PATH = DATA_DIR / "memory.json"
-MODEL_DIR = ROOT / "model"
+MODEL_DIR = Path(os.environ.get("AI_KHALED_MODEL_DIR") or ROOT / "model")
 MODEL_DIR.mkdir(parents=True, exist_ok=True)
-
-pairs = []
+MODEL_FILE = MODEL_DIR / "khalid_model.pkl"
 
 # ------------------------
 # Load dataset.csv
 # ------------------------
-if DS_PATH.exists():
+def iter_dataset_pairs(verbose=True):
+    if not DS_PATH.exists():
+        if verbose:
+            print("⚠️ ملف dataset.csv غير موجود بعد.")
+        return
     try:
         with open(DS_PATH, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
@@ -32,67 +43,218 @@ if DS_PATH.exists():
                 a = row.get("answer") or row.get("bot_text") or ""
                 q, a = q.strip(), a.strip()
                 if q and a:
-                    pairs.append((q, a))
+                    yield q, a
                     count += 1
-            print(f"✅ تم تحميل {count} زوج من dataset.csv")
+            if verbose:
+                print(f"✅ تم تحميل {count} زوج من dataset.csv")
     except Exception as e:
         print(f"⚠️ خطأ في قراءة dataset.csv: {e}")
-else:
-    print("⚠️ ملف dataset.csv غير موجود بعد.")
 
 # ------------------------
 # Load memory.json
 # ------------------------
-if MEM_PATH.exists():
+def _iter_memory_messages(f):
+    # ijson (لو متثبت) بيقرا الملف incrementally، وإلا json.load العادي
+    try:
+        import ijson
+    except Exception:
+        ijson = None
+    if ijson is not None:
+        yield from ijson.items(f, "sessions.item.messages.item")
+        return
+    for sess in json.load(f).get("sessions", []):
+        yield from sess.get("messages", [])
+
+def iter_memory_pairs(verbose=True, streaming=False):
+    if not MEM_PATH.exists():
+        if verbose:
+            print("⚠️ ملف memory.json غير موجود بعد.")
+        return
     try:
-        mem = json.load(open(MEM_PATH, "r", encoding="utf-8"))
-        mem_count = 0
-        for sess in mem.get("sessions", []):
-            for conv in sess.get("messages", []):
-                u = conv.get("user_text", "").strip()
-                b = conv.get("bot_text", "").strip()
+        mode = "rb" if streaming else "r"
+        with open(MEM_PATH, mode, **({} if streaming else {"encoding": "utf-8"})) as f:
+            messages = _iter_memory_messages(f) if streaming else (
+                m for sess in json.load(f).get("sessions", []) for m in sess.get("messages", []))
+            mem_count = 0
+            for conv in messages:
+                u = (conv.get("user_text") or "").strip()
+                b = (conv.get("bot_text") or "").strip()
                 if u and b:
-                    pairs.append((u, b))
+                    yield u, b
                     mem_count += 1
-        print(f"🧠 تم إضافة {mem_count} زوج من الذاكرة")
+        if verbose:
+            print(f"🧠 تم إضافة {mem_count} زوج من الذاكرة")
     except Exception as e:
         print(f"⚠️ خطأ في تحميل الذاكرة: {e}")
-else:
-    print("⚠️ ملف memory.json غير موجود بعد.")
+
+def iter_pairs(verbose=True, streaming=False, counts=None):
+    """counts (dict) لو اتبعت: counts["dataset"] = عدد أزواج dataset.csv اللي اتقرت."""
+    n = 0
+    for pair in iter_dataset_pairs(verbose):
+        n += 1
+        yield pair
+    if counts is not None:
+        counts["dataset"] = n
+    yield from iter_memory_pairs(verbose, streaming)
+
+def iter_chunks(it, size):
+    chunk = []
+    for item in it:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 # ------------------------
-# Check data
+# Import scikit-learn
 # ------------------------
-if not pairs:
-    print("🚫 لا توجد بيانات كافية للتدريب. أضف أسئلة إلى dataset.csv أو تحدث مع البوت أولًا.")
-    exit(0)
+def _import_sklearn():
+    try:
+        from sklearn.neighbors import KNeighborsClassifier
+        return KNeighborsClassifier
+    except Exception:
+        print("❌ لم يتم العثور على scikit-learn. ثبّتها عبر: pip install scikit-learn")
+        sys.exit(1)
 
-X, y = zip(*pairs)
-print(f"🔧 بدء التدريب على {len(pairs)} جملة من الأسئلة والأجوبة...")
+# ------------------------
+# Save model
+# ------------------------
+def save_model(vec, model, y, dataset_rows):
+    """
+    (vec, model, info): info فيها الـ labels بترتيب الصفوف (model_store.py بيدمج جيران النموذج مع
+    الصفوف المضافة من غير ما يعتمد على attributes داخلية في sklearn)، وعدد صفوف dataset.csv اللي اتدربت،
+    فالصفوف اللي اتضافت أثناء التدريب بتتطبق على النموذج الجديد.
+    """
+    # كتابة ذرية: ai_engine بيراقب الملف ويعيد تحميله، فمايشوفش ملف نص مكتوب
+    tmp = MODEL_FILE.with_suffix(".pkl.tmp")
+    info = {"y": list(y), "dataset_rows": dataset_rows}
+    with open(tmp, "wb") as f:
+        pickle.dump((vec, model, info), f)
+    os.replace(tmp, MODEL_FILE)
+    print(f"✅ انتهى التدريب بنجاح. تم حفظ النموذج في: {MODEL_FILE}")
 
 # ------------------------
-# Import scikit-learn
+# Train Model (الوضع العادي: كل البيانات في الذاكرة)
 # ------------------------
-try:
+def train_full():
+    counts = {}
+    pairs = list(iter_pairs(counts=counts))
+    if not pairs:
+        print("🚫 لا توجد بيانات كافية للتدريب. أضف أسئلة إلى dataset.csv أو تحدث مع البوت أولًا.")
+        return 0
+
+    X, y = zip(*pairs)
+    print(f"🔧 بدء التدريب على {len(pairs)} جملة من الأسئلة والأجوبة...")
+
+    KNeighborsClassifier = _import_sklearn()
     from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.neighbors import KNeighborsClassifier
-except Exception:
-    print("❌ لم يتم العثور على scikit-learn. ثبّتها عبر: pip install scikit-learn")
-    exit(1)
+    vec = TfidfVectorizer(analyzer="word", ngram_range=(1, 3))
+    Xv = vec.fit_transform(X)
+    # distance: الجار الأقرب (زي زوج لسه متعلم، model_store.py) بيكسب بدل تصويت متساوي بين الـ 3
+    model = KNeighborsClassifier(n_neighbors=min(3, len(pairs)), weights="distance")
+    model.fit(Xv, y)
+    save_model(vec, model, y, counts["dataset"])
+    return len(pairs)
 
 # ------------------------
-# Train Model
+# Train Model (--streaming: out-of-core + hashing)
 # ------------------------
-vec = TfidfVectorizer(analyzer="word", ngram_range=(1, 3))
-Xv = vec.fit_transform(X)
-model = KNeighborsClassifier(n_neighbors=3)
-model.fit(Xv, y)
+def _bounded_map(pool, fn, items, max_inflight):
+    """زي pool.map لكن بعدد محدود من الـ chunks في الذاكرة في نفس الوقت (بنفس الترتيب)."""
+    from collections import deque
+    inflight = deque()
+    for item in items:
+        inflight.append(pool.submit(fn, item))
+        if len(inflight) >= max_inflight:
+            yield inflight.popleft().result()
+    while inflight:
+        yield inflight.popleft().result()
+
+def train_streaming(workers, chunk_size, n_features):
+    KNeighborsClassifier = _import_sklearn()
+    import scipy.sparse as sp
+    from concurrent.futures import ProcessPoolExecutor
+    from text_features import HashingTfidf, chunk_df, init_worker, chunk_transform
+
+    vec = HashingTfidf(n_features=n_features)
+    max_inflight = workers * 2
+
+    # التمريرة 1: document frequency للأسئلة
+    t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        questions = ([q for q, _ in chunk] for chunk in iter_chunks(iter_pairs(verbose=False, streaming=True), chunk_size))
+        sizes = []
+        def _tagged(chunks):
+            for c in chunks:
+                sizes.append(len(c))
+                yield c
+        df_job = partial(chunk_df, n_features=n_features, ngram_range=vec.ngram_range)
+        for i, res in enumerate(_bounded_map(pool, df_job, _tagged(questions), max_inflight)):
+            vec.add_chunk_df(res, sizes[i])
+    if not vec.n_docs_:
+        print("🚫 لا توجد بيانات كافية للتدريب. أضف أسئلة إلى dataset.csv أو تحدث مع البوت أولًا.")
+        return 0
+    vec.finalize_idf()
+    print(f"📈 IDF: {vec.n_docs_} سؤال في {time.perf_counter() - t:.2f}s")
+
+    # التمريرة 2: vectorize بالتوازي + تجميع الـ labels (مع interning للإجابات المكررة)
+    t = time.perf_counter()
+    blocks, y, interned, counts = [], [], {}, {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(n_features, vec.ngram_range, vec.idf_)) as pool:
+        chunks = iter_chunks(iter_pairs(streaming=True, counts=counts), chunk_size)
+        pending_labels = []
+        def _split(chunks):
+            for c in chunks:
+                pending_labels.append([interned.setdefault(a, a) for _, a in c])
+                yield [q for q, _ in c]
+        for i, block in enumerate(_bounded_map(pool, chunk_transform, _split(chunks), max_inflight)):
+            blocks.append(block)
+            y.extend(pending_labels[i])
+            pending_labels[i] = None
+    Xv = sp.vstack(blocks, format="csr")
+    blocks = None
+    print(f"🔧 vectorize: {Xv.shape[0]} جملة ({len(interned)} إجابة مختلفة) في {time.perf_counter() - t:.2f}s")
+
+    model = KNeighborsClassifier(n_neighbors=min(3, Xv.shape[0]), weights="distance")
+    model.fit(Xv, y)
+    save_model(vec, model, y, counts["dataset"])
+    return Xv.shape[0]
 
 # ------------------------
-# Save model
+# Report
 # ------------------------
-model_file = MODEL_DIR / "khalid_model.pkl"
-with open(model_file, "wb") as f:
-    pickle.dump((vec, model), f)
+def peak_rss_mb():
+    """peak RSS للعملية + الـ workers (بالميجا). غير متاح على ويندوز."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    div = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS بالبايت، لينكس بالكيلو
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / div
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / div
+    return round(own, 1), round(children, 1)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="تدريب نموذج AI Khaled")
+    ap.add_argument("--streaming", action="store_true", help="out-of-core training with a hashing vectorizer")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-size", type=int, default=5000)
+    ap.add_argument("--n-features", type=int, default=2 ** 20)
+    args = ap.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.streaming:
+        n = train_streaming(max(1, args.workers), max(1, args.chunk_size), args.n_features)
+    else:
+        n = train_full()
+    wall = time.perf_counter() - start
+    rss = peak_rss_mb()
+    rss_txt = f"peak RSS: main={rss[0]}MB workers={rss[1]}MB" if rss else "peak RSS: n/a"
+    print(f"⏱️ {n} جملة | wall time: {wall:.2f}s | {rss_txt}")
+    return 0
 
-print(f"✅ انتهى التدريب بنجاح. تم حفظ النموذج في: {model_file}")
+if __name__ == "__main__":
+    sys.exit(main())
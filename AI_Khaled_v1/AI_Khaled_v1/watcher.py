@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+watcher.py — مراقبة ملفات البيانات وإعادة تحميلها تلقائياً (hot reload)
+- يتتبع (mtime, inode, size) لكل ملف: config.json, kb.json, dataset.csv, memory.json, والنموذج.
+- يستخدم inotify لو مكتبة inotify_simple متاحة، وإلا يعمل polling كل ثانية.
+- كل تحميل ينتج Snapshot بإصدار (version) جديد، ويتم إبلاغ المشتركين (app و ai_engine)
+  بحيث المسارات الساخنة تقرأ الإعدادات من الذاكرة بدل القرص.
+- لما العملية نفسها تكتب ملف، تنادي refresh(name) عشان اللقطة تتحدث فوراً.
+"""
+import os
+import json
+import csv
+import time
+import pickle
+import logging
+import threading
+from pathlib import Path
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except Exception:  # inotify غير متاح (ويندوز / المكتبة غير مثبتة) -> polling
+    INotify = None
+    inotify_flags = None
+
+ROOT = Path(__file__).parent
+DATA_DIR = Path(os.environ.get("AI_KHALED_DATA_DIR") or ROOT / "data")
+CONFIG_PATH = DATA_DIR / "config.json"
+KB_PATH = DATA_DIR / "kb.json"
+DS_PATH = DATA_DIR / "dataset.csv"
+MEM_PATH = DATA_DIR / "memory.json"
+MODEL_DIR = Path(os.environ.get("AI_KHALED_MODEL_DIR") or ROOT / "model")
+MODEL_PATH = MODEL_DIR / "khalid_model.pkl"
+
+POLL_INTERVAL = 1.0
+
+# ------------------------
+# Loaders
+# ------------------------
+def read_json_file(path: Path, default=None):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def iter_csv_pairs(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        for row in reader:
+            if len(row) >= 2:
+                q = row[0].strip()
+                a = row[1].strip()
+                if q and a:
+                    yield q, a
+
+def read_csv_pairs(path: Path, default=None):
+    return list(iter_csv_pairs(path))
+
+def read_pickle(path: Path, default=None):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def file_signature(path: Path):
+    """(mtime_ns, inode, size) أو None لو الملف غير موجود."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+# ------------------------
+# Snapshot
+# ------------------------
+class Snapshot:
+    """لقطة ثابتة لمحتوى ملف في لحظة معينة. لا تعدّل data مباشرة — انسخها أولاً."""
+    __slots__ = ("name", "version", "signature", "data", "loaded_at")
+
+    def __init__(self, name, version, signature, data):
+        self.name = name
+        self.version = version
+        self.signature = signature
+        self.data = data
+        self.loaded_at = time.time()
+
+    def __repr__(self):
+        return f"Snapshot({self.name!r}, version={self.version}, signature={self.signature})"
+
+# ------------------------
+# FileWatcher
+# ------------------------
+class FileWatcher:
+    def __init__(self, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self._entries = {}      # name -> (path, loader, default)
+        self._snapshots = {}    # name -> Snapshot
+        self._subscribers = {}  # name -> [callback(snapshot)]
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, name: str, path: Path, loader, default=None):
+        """
+        يسجل ملفاً ويحمله فوراً (تحميل متزامن أول مرة).
+        loader=None: تتبع التغيير فقط والمشترك هو اللي بيقرا الملف (زي corpus_store).
+        """
+        with self._lock:
+            self._entries[name] = (Path(path), loader, default)
+            self._snapshots.pop(name, None)
+            snap = self._load(name)
+        self._notify(snap)
+        return self
+
+    def subscribe(self, name: str, callback, call_now: bool = True):
+        """callback(snapshot) يُستدعى بعد كل إعادة تحميل للملف name."""
+        with self._lock:
+            self._subscribers.setdefault(name, []).append(callback)
+            snap = self._snapshots.get(name)
+        if call_now and snap is not None:
+            callback(snap)
+
+    def get(self, name: str) -> Snapshot:
+        return self._snapshots.get(name)
+
+    def value(self, name: str, default=None):
+        snap = self._snapshots.get(name)
+        if snap is None or snap.data is None:
+            return default
+        return snap.data
+
+    def versions(self) -> dict:
+        return {name: snap.version for name, snap in self._snapshots.items()}
+
+    def refresh(self, name: str, force: bool = True):
+        """إعادة تحميل ملف بعد كتابته من داخل العملية نفسها."""
+        with self._lock:
+            if name not in self._entries:
+                return None
+            if not (force or self._changed(name)):
+                return self._snapshots.get(name)
+            snap = self._load(name)
+        self._notify(snap)
+        return snap
+
+    def acknowledge(self, name: str):
+        """العملية نفسها غيرت الملف وحدثت بياناتها: سجل التوقيع الجديد بدون reload ولا إبلاغ المشتركين."""
+        with self._lock:
+            prev = self._snapshots.get(name)
+            if name not in self._entries or prev is None:
+                return None
+            path, _, _ = self._entries[name]
+            snap = Snapshot(name, prev.version + 1, file_signature(path), prev.data)
+            self._snapshots[name] = snap
+            return snap
+
+    def check(self):
+        """فحص واحد لكل الملفات. يرجع أسماء الملفات اللي اتغيرت."""
+        changed = []
+        for name in list(self._entries):
+            if self._changed(name):
+                with self._lock:
+                    # اتأكد تاني تحت القفل عشان refresh() ممكن يكون سبقنا
+                    snap = self._load(name) if self._changed(name) else None
+                if snap is not None:
+                    self._notify(snap)
+                    changed.append(name)
+        return changed
+
+    def _changed(self, name: str) -> bool:
+        path, _, _ = self._entries[name]
+        snap = self._snapshots.get(name)
+        return snap is None or file_signature(path) != snap.signature
+
+    def _load(self, name: str):
+        # تحت self._lock: بيبني اللقطة بس، والمشتركين بيتبلغوا بعد ما القفل يتساب (_notify)
+        path, loader, default = self._entries[name]
+        prev = self._snapshots.get(name)
+        sig = file_signature(path)
+        data = default
+        if sig is not None and loader is not None:
+            try:
+                data = loader(path, default)
+            except Exception as e:
+                # ملف نص مكتوب أو تالف: احتفظ بالبيانات السابقة لحد الكتابة الجاية
+                logging.warning(f"[WATCH] failed loading {path}: {e}")
+                if prev is not None:
+                    data = prev.data
+        snap = Snapshot(name, (prev.version + 1) if prev else 1, sig, data)
+        self._snapshots[name] = snap
+        if prev is not None:
+            logging.info(f"[WATCH] reloaded {name} v{snap.version}")
+        return snap
+
+    def _notify(self, snap: Snapshot):
+        # برة self._lock: المشتركين (زي corpus_store) ليهم أقفالهم وممكن ينادوا acknowledge()
+        with self._lock:
+            callbacks = list(self._subscribers.get(snap.name, []))
+        for cb in callbacks:
+            try:
+                cb(snap)
+            except Exception as e:
+                logging.warning(f"[WATCH] subscriber for {snap.name} failed: {e}")
+
+    # ------------------------
+    # background thread
+    # ------------------------
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        inotify = self._make_inotify()
+        while not self._stop.is_set():
+            try:
+                if inotify is not None:
+                    # inotify يصحّينا بدري لما يحصل تغيير، والفحص الفعلي بالتوقيع
+                    inotify.read(timeout=int(self.interval * 1000))
+                else:
+                    self._stop.wait(self.interval)
+                self.check()
+            except Exception as e:
+                logging.warning(f"[WATCH] loop error: {e}")
+                self._stop.wait(self.interval)
+
+    def _make_inotify(self):
+        if INotify is None:
+            return None
+        try:
+            ino = INotify()
+            mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO |
+                    inotify_flags.CREATE | inotify_flags.DELETE)
+            for d in {path.parent for path, _, _ in self._entries.values()}:
+                if d.exists():
+                    ino.add_watch(str(d), mask)
+            return ino
+        except Exception as e:
+            logging.warning(f"[WATCH] inotify unavailable, polling instead: {e}")
+            return None
+
+# ------------------------
+# الـ watcher المشترك بين app و ai_engine
+# ------------------------
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def get_watcher() -> FileWatcher:
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            w = FileWatcher()
+            w.watch("config", CONFIG_PATH, read_json_file, {})
+            w.watch("kb", KB_PATH, read_json_file, {})
+            w.watch("dataset", DS_PATH, None)  # البيانات نفسها في corpus_store
+            w.watch("memory", MEM_PATH, None)  # الفهرس في history
+            w.watch("model", MODEL_PATH, read_pickle, None)
+            w.start()
+            _watcher = w
+    return _watcher
+
+def current_config() -> dict:
+    """الإعدادات الحالية من الذاكرة (بدون قراءة من القرص)."""
+    return get_watcher().value("config", {}) or {}